@@ -1,23 +1,41 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from fastapi import FastAPI, Request
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+
+from fastapi import FastAPI, Request, Response
 from aiogram.types import Update, BotCommand
 from contextlib import asynccontextmanager
 
-from app.models.models import Session, SessionLocal
-from app.handlers.handlers import check_order_timeouts, notify_upcoming_orders
-from app.handlers.handlers import router
-from app.loader import bot, dp, logger
+from app.models.models import Session, SessionLocal, BotSetting
+from app.handlers.handlers import router, confirm_order_payment
+from app.models.partitions import ensure_order_partitions
+from app.scheduler import create_scheduler, election
+from app.outbox import run_dispatcher
+from app.models.routing import run_lag_probe
+from app.dedup import update_dedup
+from app.tenants import tenant_bots
+from app.middlewares import ThrottlingMiddleware, ReadYourWritesMiddleware, HandlerTimingMiddleware, load_monitor
+from app.capture import update_capture
+from app.payments import PAYMENT_RESULTS, PAYMENT_INTERMEDIATE_STATUSES
+from app import metrics
+from app.loader import get_bot, close_bot, dp, logger
 from app.config import *
 
+if WEB_CONCURRENCY > 1:
+    # A TAP HANDLED BY ANOTHER WORKER WOULD SEE AN EMPTY CART AND NO FSM STATE
+    raise ValueError('WEB_CONCURRENCY must be 1 until carts and FSM state are kept in shared storage')
+
 app = FastAPI()
+background_tasks = set()
+REGISTER_RETRY_MAX_SECONDS = 300
 
-async def set_my_commands():
-    commands = [
-        BotCommand(command="/start", description="Начать диалог"),
-        BotCommand(command="/new", description="Сделать новый заказ"),
-        BotCommand(command="/cancel", description="Отмена"),
-    ]
-    await bot.set_my_commands(commands)
+BOT_COMMANDS = [
+    BotCommand(command="/start", description="Начать диалог"),
+    BotCommand(command="/new", description="Сделать новый заказ"),
+    BotCommand(command="/cancel", description="Отмена"),
+]
 
 @asynccontextmanager
 async def get_db_session():
@@ -27,26 +45,173 @@ async def get_db_session():
     finally:
         session.close()
 
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def register_webhook(bot, url: str, secret: str, setting_key: str) -> bool:
+    config_hash = hashlib.sha256(json.dumps({
+        'url': url,
+        'secret': secret,
+        'commands': [command.model_dump(mode='json') for command in BOT_COMMANDS],
+    }, sort_keys=True).encode()).hexdigest()
+
+    try:
+        with SessionLocal() as session:
+            stored = session.get(BotSetting, setting_key)
+            if stored and stored.value == config_hash:
+                logger.info(f"Webhook and commands of bot {bot.id} unchanged, registration skipped.")
+                return True
+
+        # getWebhookInfo DOESN'T REPORT THE SECRET TOKEN, SO A CHANGED HASH ALWAYS RE-REGISTERS
+        await bot.set_webhook(url, secret_token=secret)
+        await bot.set_my_commands(BOT_COMMANDS)
+
+        with SessionLocal() as session:
+            session.merge(BotSetting(key=setting_key, value=config_hash))
+            session.commit()
+        logger.info(f"Webhook of bot {bot.id} set and bot ready.")
+        return True
+    except Exception as e:
+        logger.error(f"Error registering webhook of bot {bot.id}: {e}")
+        return False
+
+async def register_bot():
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_HOST is not set, webhook registration skipped.")
+        return
+
+    # UPDATES ARE CHECKED AGAINST THE SECRET FROM THE START, SO UNTIL TELEGRAM KNOWS IT THEY ARE REJECTED; KEEP TRYING
+    delay = 1
+    while not await register_webhook(get_bot(), WEBHOOK_URL, WEBHOOK_SECRET, 'bot_config_hash'):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, REGISTER_RETRY_MAX_SECONDS)
+
+async def watch_tenants():
+    # EVERY INSTANCE KEEPS ITS OWN TENANT MAP; THE CONFIG HASH KEEPS REGISTRATION TO ONCE PER CHANGE,
+    # A FAILED REGISTRATION IS RETRIED ON THE NEXT REFRESH
+    unregistered = set()
+    while True:
+        try:
+            changed = await asyncio.to_thread(tenant_bots.load)
+            if WEBHOOK_URL:
+                unregistered.update(changed)
+                for bot_id in list(unregistered):
+                    if bot_id not in tenant_bots or await register_webhook(
+                        tenant_bots.get(bot_id),
+                        f'{WEBHOOK_URL}/{bot_id}',
+                        tenant_bots.secret(bot_id),
+                        f'bot_config_hash:{bot_id}'
+                    ):
+                        unregistered.discard(bot_id)
+        except Exception as e:
+            logger.error(f"Error refreshing tenants: {e}")
+        await asyncio.sleep(TENANT_REFRESH_SECONDS)
+
 async def on_startup():
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_order_timeouts, 'interval', minutes=1)
-    scheduler.add_job(notify_upcoming_orders, 'interval', minutes=1)
+    # NOTHING HERE WAITS ON THE NETWORK OR THE DATABASE, SO THE APP STARTS SERVING IMMEDIATELY
+    scheduler = create_scheduler()
     scheduler.start()
-    
-    await bot.set_webhook(WEBHOOK_URL)
-    await set_my_commands()
-    logger.info("Webhook set and bot ready.")
+
+    run_in_background(asyncio.to_thread(ensure_order_partitions))
+    if MULTI_TENANT:
+        run_in_background(watch_tenants())
+    if TOKEN:
+        run_in_background(register_bot())
+    # EVERY INSTANCE DRAINS THE OUTBOX, ROWS ARE CLAIMED WITH SKIP LOCKED
+    run_in_background(run_dispatcher())
+    run_in_background(load_monitor.run())
+    if DATABASE_REPLICA_URLS:
+        run_in_background(run_lag_probe())
+    if update_capture:
+        run_in_background(update_capture.run())
 
 async def on_shutdown():
-    await bot.session.close()
+    election.release()
+    for task in list(background_tasks):
+        task.cancel()
+    if update_capture:
+        await update_capture.flush()
+    await close_bot()
     logger.info("Bot session closed.")
 
 @app.post(WEBHOOK_PATH)
 async def process_update(request: Request):
-    update = Update(**await request.json())
-    await dp.feed_webhook_update(bot, update)
+    if not TOKEN:
+        return Response(status_code=404)
+    return await feed_update(request, get_bot(), WEBHOOK_SECRET)
+
+@app.post(WEBHOOK_PATH + '/{bot_id}')
+async def process_tenant_update(bot_id: int, request: Request):
+    bot = tenant_bots.get(bot_id)
+    if bot is None:
+        # UNKNOWN OR DEACTIVATED TENANT; TELEGRAM RETRIES, SO A JUST-ADDED TENANT IS PICKED UP ON THE NEXT REFRESH
+        metrics.inc('updates.unknown_bot')
+        return Response(status_code=404)
+    return await feed_update(request, bot, tenant_bots.secret(bot_id))
+
+async def feed_update(request: Request, bot, expected_secret: str):
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if expected_secret and not hmac.compare_digest(secret, expected_secret):
+        metrics.inc('updates.forged_dropped')
+        return Response(status_code=403)
+
+    payload = json.loads(await request.body())
+    update_id = payload.get('update_id')
+    if update_id is not None and not update_dedup.claim(bot.id, update_id):
+        metrics.inc('updates.duplicates_dropped')
+        return {"ok": True}
+
+    received_at = time.time()
+    started = time.perf_counter()
+    try:
+        await dp.feed_webhook_update(bot, Update(**payload))
+    except Exception:
+        if update_id is not None:
+            update_dedup.release(bot.id, update_id)
+        raise
+    finally:
+        if update_capture:
+            update_capture.record(bot.id, received_at, time.perf_counter() - started, payload)
     return {"ok": True}
 
+@app.post(PAYMENT_CALLBACK_PATH)
+async def process_payment_callback(request: Request):
+    # WITHOUT A SHARED SECRET ANYONE COULD MARK ORDERS PAID, SO THE ENDPOINT STAYS CLOSED
+    secret = request.headers.get('X-Payment-Secret', '')
+    if not PAYMENT_CALLBACK_SECRET or not hmac.compare_digest(secret, PAYMENT_CALLBACK_SECRET):
+        return Response(status_code=403)
+
+    try:
+        payload = await request.json()
+        payment_key, status = payload['idempotency_key'], payload['status']
+    except (ValueError, KeyError, TypeError):
+        return Response(status_code=400)
+    if not isinstance(payment_key, str) or not isinstance(status, str):
+        return Response(status_code=400)
+    if status in PAYMENT_INTERMEDIATE_STATUSES:
+        return {"ok": True, "updated": False}
+    if status not in PAYMENT_RESULTS:
+        return Response(status_code=400)
+
+    updated = await confirm_order_payment(payment_key, PAYMENT_RESULTS[status])
+    return {"ok": True, "updated": updated}
+
+@app.get('/metrics')
+async def get_metrics():
+    return metrics.snapshot()
+
 app.add_event_handler("startup", on_startup)
 app.add_event_handler("shutdown", on_shutdown)
+throttling = ThrottlingMiddleware()
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+dp.inline_query.outer_middleware(throttling)
+read_your_writes = ReadYourWritesMiddleware()
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.outer_middleware(read_your_writes)
+handler_timing = HandlerTimingMiddleware()
+for observer in (dp.message, dp.callback_query, dp.inline_query):
+    observer.middleware(handler_timing)
 dp.include_router(router=router)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime
+
+from app.config import CAPTURE_DIR, CAPTURE_SCRUB_PII
+from app.loader import logger
+
+FLUSH_SECONDS = 5
+PII_FIELDS = ('first_name', 'last_name', 'username', 'phone_number', 'email')
+DROPPED_FIELDS = ('contact', 'location', 'venue')
+
+def scrub_pii(value):
+    # IDS AND MESSAGE TEXT STAY: REPLAY NEEDS THEM TO DRIVE THE SAME FSM STATES AND DB ROWS
+    if isinstance(value, dict):
+        return {
+            key: ('x' if key in PII_FIELDS and isinstance(item, str) else scrub_pii(item))
+            for key, item in value.items()
+            if key not in DROPPED_FIELDS
+        }
+    if isinstance(value, list):
+        return [scrub_pii(item) for item in value]
+    return value
+
+class UpdateCapture:
+    # RECORDS ARE BUFFERED ON THE EVENT LOOP AND WRITTEN FROM A THREAD; EVERY FLUSH APPENDS ONE GZIP MEMBER
+    # TO AN HOURLY FILE PER WORKER, WHICH gzip.open READS BACK AS A SINGLE STREAM
+    def __init__(self, directory: str, scrub: bool):
+        self.directory = directory
+        self.scrub = scrub
+        self._buffer = []
+
+    def record(self, bot_id: int, received_at: float, duration: float, payload: dict):
+        self._buffer.append(json.dumps({
+            'ts': round(received_at, 6),
+            'ms': round(duration * 1000, 3),
+            'bot_id': bot_id,
+            'update': scrub_pii(payload) if self.scrub else payload,
+        }, ensure_ascii=False, separators=(',', ':')))
+
+    def path(self) -> str:
+        return os.path.join(self.directory, f"updates-{datetime.now().strftime('%Y%m%d-%H')}-{os.getpid()}.jsonl.gz")
+
+    def write(self, lines: list):
+        os.makedirs(self.directory, exist_ok=True)
+        with gzip.open(self.path(), 'at', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    async def flush(self):
+        lines, self._buffer = self._buffer, []
+        if lines:
+            try:
+                await asyncio.to_thread(self.write, lines)
+            except Exception as e:
+                logger.error(f'Error writing {len(lines)} captured updates: {e}')
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            await self.flush()
+
+update_capture = UpdateCapture(CAPTURE_DIR, CAPTURE_SCRUB_PII) if CAPTURE_DIR else None
+
+def read_capture(paths: list) -> list:
+    records = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['ts'])
+    return records
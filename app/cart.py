@@ -0,0 +1,86 @@
+import time
+from decimal import Decimal
+
+CART_TTL_SECONDS = 2 * 60 * 60
+
+class Cart:
+    __slots__ = ('store_id', 'items', 'prices', 'total', 'count', 'expires_at')
+
+    def __init__(self, store_id: int):
+        self.store_id = store_id
+        self.items = {} # ITEM ID -> QUANTITY
+        self.prices = {} # ITEM ID -> UNIT PRICE AT THE MOMENT IT WAS ADDED
+        self.total = Decimal(0)
+        self.count = 0
+        self.expires_at = 0.0
+
+class CartStore:
+    # EVERY OPERATION IS SYNCHRONOUS, SO ON THE EVENT LOOP IT CAN'T INTERLEAVE WITH ANOTHER TAP;
+    # PER PROCESS, WHICH IS WHY app/app.py REFUSES WEB_CONCURRENCY > 1
+    def __init__(self, ttl: int = CART_TTL_SECONDS):
+        self.ttl = ttl
+        self._carts = {} # (BOT ID, USER ID) -> CART, THE SAME USER HAS A SEPARATE CART IN EVERY TENANT'S BOT
+
+    def get(self, bot_id: int, user_id: int) -> Cart | None:
+        key = (bot_id, user_id)
+        cart = self._carts.get(key)
+        if cart is None:
+            return None
+
+        if cart.expires_at < time.monotonic():
+            del self._carts[key]
+            return None
+
+        return cart
+
+    def add(self, bot_id: int, user_id: int, store_id: int, item_id: int, price: Decimal) -> Cart:
+        cart = self.get(bot_id, user_id)
+        if cart is None or cart.store_id != store_id:
+            cart = self._carts[(bot_id, user_id)] = Cart(store_id)
+
+        # THE PRICE CAPTURED ON THE FIRST ADD STAYS, SO total ALWAYS MATCHES THE LINES
+        price = cart.prices.setdefault(item_id, Decimal(price or 0))
+        cart.items[item_id] = cart.items.get(item_id, 0) + 1
+        cart.total += price
+        cart.count += 1
+        cart.expires_at = time.monotonic() + self.ttl
+        return cart
+
+    def remove(self, bot_id: int, user_id: int, item_id: int) -> Cart | None:
+        cart = self.get(bot_id, user_id)
+        if cart is None or item_id not in cart.items:
+            return cart
+
+        cart.items[item_id] -= 1
+        cart.total -= cart.prices[item_id]
+        cart.count -= 1
+        if cart.items[item_id] == 0:
+            del cart.items[item_id]
+            del cart.prices[item_id]
+
+        if not cart.items:
+            del self._carts[(bot_id, user_id)]
+            return None
+
+        cart.expires_at = time.monotonic() + self.ttl
+        return cart
+
+    def clear(self, bot_id: int, user_id: int):
+        self._carts.pop((bot_id, user_id), None)
+
+    def pop(self, bot_id: int, user_id: int) -> Cart | None:
+        cart = self.get(bot_id, user_id)
+        self.clear(bot_id, user_id)
+        return cart
+
+    def restore(self, bot_id: int, user_id: int, cart: Cart):
+        # PUTS A POPPED CART BACK, UNLESS THE USER HAS STARTED A NEW ONE SINCE
+        cart.expires_at = time.monotonic() + self.ttl
+        self._carts.setdefault((bot_id, user_id), cart)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, cart in self._carts.items() if cart.expires_at < now]:
+            del self._carts[key]
+
+cart_store = CartStore()
@@ -1,4 +1,6 @@
 import os 
+import hashlib
+from datetime import timedelta, timezone
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -8,7 +10,44 @@ TOKEN = os.getenv('BOT_TOKEN')
 # SERVER SETTINGS
 WEBHOOK_HOST = os.getenv('WEBHOOK_HOST')
 WEBHOOK_PATH = '/webhook'
-WEBHOOK_URL = WEBHOOK_HOST + WEBHOOK_PATH
+WEBHOOK_URL = WEBHOOK_HOST + WEBHOOK_PATH if WEBHOOK_HOST else None
+# DERIVED FROM THE TOKEN BY DEFAULT SO EVERY WORKER AGREES ON IT WITHOUT EXTRA CONFIG
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or (hashlib.sha256(TOKEN.encode()).hexdigest() if TOKEN else None)
+# CARTS (app/cart.py) AND FSM STATE (aiogram's MemoryStorage) LIVE IN THE WORKER PROCESS, SO ONLY ONE WORKER IS SUPPORTED
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+UPDATE_DEDUP_WINDOW = int(os.getenv('UPDATE_DEDUP_WINDOW', '10000'))
+# e.g. AN OLD AND A NEW INSTANCE BRIEFLY SERVING SIDE BY SIDE DURING A DEPLOY
+UPDATE_DEDUP_SHARED = os.getenv('UPDATE_DEDUP_SHARED', str(WEB_CONCURRENCY > 1)).lower() in ('1', 'true', 'yes')
+
+# MULTI-TENANT: ONE PROCESS SERVES EVERY ACTIVE BOT IN THE tenants TABLE ON WEBHOOK_PATH/{bot_id}
+MULTI_TENANT = os.getenv('MULTI_TENANT', '').lower() in ('1', 'true', 'yes')
+TENANT_REFRESH_SECONDS = int(os.getenv('TENANT_REFRESH_SECONDS', '60'))
+
+# TRAFFIC CAPTURE FOR scripts/replay.py; OFF UNLESS CAPTURE_DIR IS SET
+CAPTURE_DIR = os.getenv('CAPTURE_DIR')
+CAPTURE_SCRUB_PII = os.getenv('CAPTURE_SCRUB_PII', 'true').lower() in ('1', 'true', 'yes')
 
 # DATABASE
-DATABASE_URL = os.getenv('DATABASE_URL')
\ No newline at end of file
+DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '30')) # USER READS GO TO THE PRIMARY THIS LONG AFTER THEIR WRITE
+
+# TIME
+MSK = timezone(timedelta(hours=3))
+
+# PAYMENTS
+PAYMENT_PROVIDER = os.getenv('PAYMENT_PROVIDER', 'stub')
+PAYMENT_CALLBACK_PATH = '/payments/callback'
+PAYMENT_CALLBACK_SECRET = os.getenv('PAYMENT_CALLBACK_SECRET')
+PAYMENT_STUB_LATENCY = float(os.getenv('PAYMENT_STUB_LATENCY', '1.5'))
+PAYMENT_STUB_FAILURE_RATE = float(os.getenv('PAYMENT_STUB_FAILURE_RATE', '0'))
+
+# LOAD PROTECTION
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '2')) # TOKENS PER SECOND PER USER
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+# STAFF COMMANDS SKIP LOAD SHEDDING BUT KEEP A LARGER PER-USER BUCKET, SINCE ANYONE CAN SEND THEM
+STAFF_THROTTLE_RATE = float(os.getenv('STAFF_THROTTLE_RATE', '5'))
+STAFF_THROTTLE_BURST = int(os.getenv('STAFF_THROTTLE_BURST', '20'))
+MAX_EVENT_LOOP_LAG = float(os.getenv('MAX_EVENT_LOOP_LAG', '0.5')) # SECONDS
+MAX_IN_FLIGHT_UPDATES = int(os.getenv('MAX_IN_FLIGHT_UPDATES', '200'))
\ No newline at end of file
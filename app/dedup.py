@@ -0,0 +1,77 @@
+from collections import deque
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.models import SessionLocal, ProcessedUpdate
+from app.config import UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_SHARED
+from app.loader import logger
+
+class UpdateDeduplicator:
+    # RECENT (bot_id, update_id) PAIRS ARE KEPT IN A BOUNDED LOCAL WINDOW; WITH SEVERAL WORKERS THE
+    # processed_updates TABLE DECIDES WHICH ONE CLAIMS A REDELIVERED UPDATE
+    def __init__(self, window: int, shared: bool):
+        self.window = window
+        self.shared = shared
+        self._order = deque()
+        self._ids = set()
+
+    def claim(self, bot_id: int, update_id: int) -> bool:
+        key = (bot_id, update_id)
+        if key in self._ids:
+            return False
+
+        if self.shared:
+            with SessionLocal() as session:
+                claimed = session.execute(
+                    insert(ProcessedUpdate)
+                    .values(bot_id=bot_id, update_id=update_id)
+                    .on_conflict_do_nothing()
+                    .returning(ProcessedUpdate.update_id)
+                ).first()
+                session.commit()
+            if claimed is None:
+                self._remember(key)
+                return False
+
+        self._remember(key)
+        return True
+
+    def release(self, bot_id: int, update_id: int):
+        # PROCESSING FAILED, LET TELEGRAM'S REDELIVERY THROUGH
+        key = (bot_id, update_id)
+        if key in self._ids:
+            self._ids.discard(key)
+            self._order.remove(key)
+
+        if self.shared:
+            with SessionLocal() as session:
+                session.execute(delete(ProcessedUpdate).where(
+                    ProcessedUpdate.bot_id == bot_id,
+                    ProcessedUpdate.update_id == update_id
+                ))
+                session.commit()
+
+    def _remember(self, key: tuple):
+        self._order.append(key)
+        self._ids.add(key)
+        if len(self._order) > self.window:
+            self._ids.discard(self._order.popleft())
+
+update_dedup = UpdateDeduplicator(UPDATE_DEDUP_WINDOW, UPDATE_DEDUP_SHARED)
+
+def prune_processed_updates():
+    try:
+        with SessionLocal() as session:
+            newest = (
+                select(ProcessedUpdate.bot_id, func.max(ProcessedUpdate.update_id).label('update_id'))
+                .group_by(ProcessedUpdate.bot_id)
+                .subquery()
+            )
+            session.execute(delete(ProcessedUpdate).where(
+                ProcessedUpdate.bot_id == newest.c.bot_id,
+                ProcessedUpdate.update_id < newest.c.update_id - UPDATE_DEDUP_WINDOW
+            ))
+            session.commit()
+    except Exception as e:
+        logger.error(f'Error pruning processed updates: {e}')
@@ -2,21 +2,35 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineQuery
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
 from aiogram import F, Router
 
 from app.models.models import SessionLocal
-from app.models.models import User, Store, Category, Staff, Order
-from app.loader import bot, logger
+from app.models.routing import read_session, mark_write
+from app.models.partitions import OPEN_ORDERS_HORIZON
+from app.models import repository
+from app.models.models import User, Order
+from app.loader import logger
+from app.config import MSK
+from app.outbox import enqueue_message, wake_dispatcher
+from app.cart import cart_store
+from app.tenants import tenant_id
+from app.payments import create_payment_provider
+from app.search import search_menu_items
+from app.prep_queue import set_order_status
+from app import metrics
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select, or_
 from typing import Union
+from uuid import uuid4
 import re
 
 router = Router(name = __name__)
-MSK = timezone(timedelta(hours=3))
+UNPAID_ORDER_TIMEOUT = timedelta(minutes=30)
+SEARCH_RESULT_RE = re.compile(r'#(\d+)$')
+STAFF_READ_MAX_LAG = 1.0 # SECONDS; STAFF LISTS TOLERATE LESS STALENESS THAN MENU BROWSING
 
 class OrderState(StatesGroup):
     SELECT_STORE = State()
@@ -37,14 +51,10 @@ async def check_order_timeouts():
         with SessionLocal() as session:
             threshold = datetime.now(MSK) - timedelta(minutes=15)
             
-            expired_orders = session.query(Order).filter(
-                Order.status == 'CREATED',
-                Order.target_ready_at < threshold
-            ).all()
+            expired_orders = repository.list_expired_orders(session, threshold)
             
             for order in expired_orders:
-                order.status = 'CANCELLED'
-                session.commit()
+                set_order_status(session, order, 'CANCELLED')
                 
                 builder = InlineKeyboardBuilder()
                 builder.add(
@@ -61,15 +71,18 @@ async def check_order_timeouts():
                 )
                 builder.adjust(2)
                 
-                try:
-                    await bot.send_message(
-                        chat_id=order.client_id,
-                        text='Время ожидания истекло. Заказ не был принят.', 
-                        reply_markup=builder.as_markup()
-                    )
-                    
-                except Exception as e:
-                    logger.error(f'Failed to notify user {order.client_id}: {e}')
+                enqueue_message(
+                    session,
+                    dedup_key=f'order_expired:{order.id}:{order.created_at.isoformat()}',
+                    chat_id=order.client_id,
+                    text='Время ожидания истекло. Заказ не был принят.', 
+                    reply_markup=builder.as_markup(),
+                    bot_id=order.bot_id
+                )
+            session.commit()
+            
+            if expired_orders:
+                wake_dispatcher()
     except Exception as e:
         logger.error(f'Error in timeout loop: {e}')
 
@@ -79,19 +92,26 @@ async def retry_order_handler(c: CallbackQuery, state: FSMContext):
     
     try:
         with SessionLocal() as session:
-            order = session.query(Order).filter(Order.id == order_id).first()
+            order = repository.get_order(session, order_id, for_update=True)
             
-            if not order:
+            if not order or order.client_id != c.from_user.id:
                 await c.answer("Заказ не найден.")
                 return
 
-            order.status = 'CREATED'
+            # ONLY A PAID ORDER THAT TIMED OUT CAN GO BACK TO STAFF
+            if order.status != 'CANCELLED' or order.payment_status != 'PAID':
+                await c.answer("Этот заказ нельзя повторить.", show_alert=True)
+                return
+
+            set_order_status(session, order, 'CREATED')
             order.target_ready_at = datetime.now(MSK) + timedelta(minutes=15)
             order.created_at = datetime.now(MSK)
+            # SCHEDULED ORDERS ARE PICKED UP BY notify_upcoming_orders, ASAP ONES HAVE TO BE ANNOUNCED HERE
+            if order.pickup_option == 'ASAP':
+                notify_staff_new_order(session, order)
             session.commit()
-            
-            store_id = order.store_id
 
+        wake_dispatcher()
         await c.message.edit_text(
             text=f"Заказ №{order_id} отправлен повторно.",
             parse_mode='HTML'
@@ -113,9 +133,7 @@ async def start_command(m: Message, state: FSMContext):
         first_name = m.from_user.first_name
         
         with SessionLocal() as session:
-            existing_user = session.query(User).filter(User.telegram_id == telegram_id).first()
-            
-            if existing_user:
+            if repository.user_exists(session, telegram_id):
                 logger.info('User already exists.')
             else:
                 new_user = User(telegram_id=telegram_id, username=username, first_name=first_name)
@@ -147,8 +165,8 @@ async def choose_store(event: Union[Message, CallbackQuery], state: FSMContext):
     builder = InlineKeyboardBuilder()
     
     try:
-        with SessionLocal() as session:
-            stores = session.query(Store).all()
+        with read_session(event.from_user.id) as session:
+            stores = repository.list_stores(session, tenant_id(event.bot))
 
             if not stores:
                 if is_callback:
@@ -157,10 +175,7 @@ async def choose_store(event: Union[Message, CallbackQuery], state: FSMContext):
                     await event.answer('Заведения недоступны.')
                 return 
             
-            active_store_ids = {
-                s.store_id for s in session.query(Staff.store_id)
-                .filter(Staff.status == 'active').all()
-            }
+            active_store_ids = repository.get_active_store_ids(session)
             
             for i, store in enumerate(stores, start=1):
                 msg_text += f'\n\n<b>{i}. {store.name}</b>\n{store.address} ({store.working_hours})'
@@ -175,7 +190,7 @@ async def choose_store(event: Union[Message, CallbackQuery], state: FSMContext):
             await state.set_state(OrderState.SELECT_ITEMS)
 
             if is_callback:
-                await bot.edit_message_text(
+                await event.bot.edit_message_text(
                     text=msg_text,
                     chat_id=msg_obj.chat.id,
                     message_id=msg_obj.message_id,
@@ -189,7 +204,7 @@ async def choose_store(event: Union[Message, CallbackQuery], state: FSMContext):
         logger.error(f'Error listing stores: {e}')
         error_text = 'Ошибка загрузки заведений. Попробуйте еще раз.'
         if is_callback:
-            await bot.edit_message_text(text=error_text, chat_id=msg_obj.chat.id, message_id=msg_obj.message_id)
+            await event.bot.edit_message_text(text=error_text, chat_id=msg_obj.chat.id, message_id=msg_obj.message_id)
         else:
             await msg_obj.answer(error_text)
 
@@ -202,38 +217,93 @@ async def choose_items(c: CallbackQuery, state: FSMContext):
 
 @router.callback_query(lambda c: c.data.startswith('add:'))
 async def add_to_cart(c: CallbackQuery, state: FSMContext):
-    item_id = c.data.split(':')[1]
-
-    data = await state.get_data()
-    cart = data.get('cart', {})
-    cart[item_id] = cart.get(item_id, 0) + 1
-    await state.update_data(cart=cart)
+    item_id = int(c.data.split(':')[1])
 
-    store_id = data.get('current_store_id')
-    if store_id:
-        await render_menu(c, state, store_id)
-        
-    item_name = "Товар"
     try:
-        with SessionLocal() as session:
-            item = session.query(Category).filter(Category.id == item_id).first()
-            if item:
-                item_name = item.name
-            
-            await c.answer(text=f'{item_name} — добавлен в корзину.')
+        with read_session(c.from_user.id) as session:
+            item = repository.get_menu_item(session, item_id, tenant_id(c.bot))
+
+        if not item:
+            await c.answer(text='Товар не найден.')
+            return
+
+        cart_store.add(c.bot.id, c.from_user.id, item.store_id, item.id, item.price)
+        await render_menu(c, state, item.store_id)
+        await c.answer(text=f'{item.name} — добавлен в корзину.')
             
     except Exception as e:
         logger.error(f'Error adding item: {e}')
         await c.answer(text='Ошибка. Попробуйте еще раз.')
 
+def get_item_names(item_ids) -> dict:
+    with read_session() as session:
+        return repository.get_item_names(session, item_ids)
+
+@router.inline_query()
+async def search_menu(q: InlineQuery, state: FSMContext):
+    data = await state.get_data()
+    cart = cart_store.get(q.bot.id, q.from_user.id)
+    store_id = data.get('current_store_id') or (cart.store_id if cart else None)
+
+    if not store_id:
+        await q.answer(
+            results=[],
+            cache_time=1,
+            is_personal=True,
+            button=InlineQueryResultsButton(text='Выбрать заведение', start_parameter='new')
+        )
+        return
+
+    try:
+        items = search_menu_items(int(store_id), q.query, tenant_id(q.bot))
+    except Exception as e:
+        logger.error(f'Error searching menu: {e}')
+        items = []
+
+    results = [
+        InlineQueryResultArticle(
+            id=str(item.id),
+            title=item.name,
+            description=f'{item.price} руб.',
+            input_message_content=InputTextMessageContent(message_text=f'🔍 {item.name} #{item.id}')
+        )
+        for item in items
+    ]
+    await q.answer(results=results, cache_time=5, is_personal=True)
+
+# A PICKED RESULT ARRIVES AS THE USER'S OWN MESSAGE SENT via_bot; chosen_inline_result WOULD NEED INLINE
+# FEEDBACK ENABLED BY HAND IN @BotFather. REGISTERED BEFORE THE STATE HANDLERS SO e.g. CUSTOM_TIME_INPUT NEVER SEES IT
+@router.message(lambda m: m.via_bot is not None and m.via_bot.id == m.bot.id)
+async def add_from_search(m: Message, state: FSMContext):
+    match = SEARCH_RESULT_RE.search(m.text or '')
+    if not match:
+        return
+
+    try:
+        with read_session(m.from_user.id) as session:
+            item = repository.get_menu_item(session, int(match.group(1)), tenant_id(m.bot))
+
+        if not item:
+            await m.answer('Позиция не найдена.')
+            return
+
+        cart = cart_store.add(m.bot.id, m.from_user.id, item.store_id, item.id, item.price)
+
+        builder = InlineKeyboardBuilder()
+        builder.row(InlineKeyboardButton(text=f'Корзина ({cart.count})', style='primary', callback_data='view_cart'))
+        await m.answer(f'{item.name} — добавлен в корзину.', reply_markup=builder.as_markup())
+        await m.delete()
+    except Exception as e:
+        logger.error(f'Error adding item from search: {e}')
+
 @router.callback_query(F.data =='view_cart')
 async def view_cart(c: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    cart = data.get('cart', {})
+    cart = cart_store.get(c.bot.id, c.from_user.id)
 
     if not cart:
         await c.answer(text='Ваша корзина пуста.', show_alert=True)
     
+        data = await state.get_data()
         store_id = data.get('current_store_id')
         if store_id and "Меню:" not in (c.message.text or ""):
             await render_menu(c, state, store_id)
@@ -241,26 +311,20 @@ async def view_cart(c: CallbackQuery, state: FSMContext):
 
     msg = '<b>Ваша корзина:</b>'
     builder = InlineKeyboardBuilder()
-    total_summary = 0
     
     try:
-        with SessionLocal() as session:
-            for i, (item_id, quantity) in enumerate(cart.items(), start=1):
-                item = session.query(Category).filter(Category.id == item_id).first()
-                
-                if item:
-                    item_price = item.price * quantity
-                    total_summary += item_price
-                    
-                    msg += f'\n\n{i}. {item.name} (x{quantity}) — {item_price} руб.'
+        item_names = get_item_names(list(cart.items))
+        for i, (item_id, quantity) in enumerate(cart.items.items(), start=1):
+            item_price = cart.prices[item_id] * quantity
+            msg += f'\n\n{i}. {item_names.get(item_id, f"ID {item_id}")} (x{quantity}) — {item_price} руб.'
 
-        msg += f'\n\n<b>Итого: {total_summary} руб.</b>'
+        msg += f'\n\n<b>Итого: {cart.total} руб.</b>'
         
         builder.row(InlineKeyboardButton(text='Оформить заказ', style='success', callback_data='create_order'))
         builder.row(InlineKeyboardButton(text='Убрать товары', style='danger', callback_data='edit_cart'))
         builder.row(InlineKeyboardButton(text='Меню', style='primary', callback_data='back_to_menu'))
         
-        await bot.edit_message_text(
+        await c.bot.edit_message_text(
             text=msg,
             chat_id=c.message.chat.id,
             message_id=c.message.message_id, 
@@ -270,7 +334,7 @@ async def view_cart(c: CallbackQuery, state: FSMContext):
 
     except Exception as e:
         logger.error(f'Failed viewing cart: {e}')
-        await bot.edit_message_text(
+        await c.bot.edit_message_text(
             text='Ошибка загрузки корзины. Попробуйте еще раз.',
             chat_id=c.message.chat.id,
             message_id=c.message.message_id
@@ -278,26 +342,27 @@ async def view_cart(c: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == 'edit_cart')
 async def edit_cart_mode(c: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    cart = data.get('cart', {})
+    cart = cart_store.get(c.bot.id, c.from_user.id)
+    if not cart:
+        await view_cart(c, state)
+        return
 
     msg = '<b>Режим редактирования</b>\nНажмите на товар, чтобы уменьшить количество или удалить его:'
     builder = InlineKeyboardBuilder()
 
-    with SessionLocal() as session:
-        for item_id, quantity in cart.items():
-            item = session.query(Category).filter(Category.id == item_id).first()
-            if item:
-                builder.add(InlineKeyboardButton(
-                    text=f'❌ {item.name} ({quantity} шт.)',
-                    style='danger',
-                    callback_data=f'remove:{item_id}'
-                ))
+    item_names = get_item_names(list(cart.items))
+    for item_id, quantity in cart.items.items():
+        if item_id in item_names:
+            builder.add(InlineKeyboardButton(
+                text=f'❌ {item_names[item_id]} ({quantity} шт.)',
+                style='danger',
+                callback_data=f'remove:{item_id}'
+            ))
 
     builder.adjust(1)
     builder.row(InlineKeyboardButton(text='Вернуться в корзину', style='primary', callback_data='view_cart'))
 
-    await bot.edit_message_text(
+    await c.bot.edit_message_text(
         text=msg,
         chat_id=c.message.chat.id,
         message_id=c.message.message_id,
@@ -307,17 +372,8 @@ async def edit_cart_mode(c: CallbackQuery, state: FSMContext):
 
 @router.callback_query(lambda c: c.data.startswith('remove:'))
 async def remove_from_cart(c: CallbackQuery, state: FSMContext):
-    item_id = c.data.split(':')[1]
-    data = await state.get_data()
-    cart = data.get('cart', {})
-
-    if item_id in cart:
-        if cart[item_id] > 1:
-            cart[item_id] -= 1
-        else:
-            del cart[item_id]
-    
-    await state.update_data(cart=cart)
+    item_id = int(c.data.split(':')[1])
+    cart = cart_store.remove(c.bot.id, c.from_user.id, item_id)
     
     if not cart:
         await view_cart(c, state)
@@ -341,7 +397,7 @@ async def choose_pickup_time(c: CallbackQuery, state: FSMContext):
         builder.adjust(1, 3, 1, 1)
         msg = 'Выберите время готовности заказа: '
         
-        await bot.edit_message_text(
+        await c.bot.edit_message_text(
             text=msg,
             chat_id=c.message.chat.id,
             message_id=c.message.message_id, 
@@ -351,7 +407,7 @@ async def choose_pickup_time(c: CallbackQuery, state: FSMContext):
         
     except Exception as e:
         logger.error(f'Failed choose time: {e}')
-        await bot.edit_message_text(
+        await c.bot.edit_message_text(
             text='Ошибка выбора времени. Попробуйте еще раз.',
             chat_id=c.message.chat.id,
             message_id=c.message.message_id
@@ -434,67 +490,134 @@ async def show_payment_methods(event: Union[CallbackQuery, Message], state: FSMC
         await event.answer(text, reply_markup=builder.as_markup(), parse_mode='HTML')
 
 @router.callback_query(OrderState.PAYMENT_METHOD, F.data.startswith('pay:'))
-async def process_payment_prototype(c: CallbackQuery, state: FSMContext):
+async def process_payment(c: CallbackQuery, state: FSMContext):
     method = c.data.split(':')[1].upper()
-    await c.message.edit_text(f"🔄 Установка соединения с {method}...")
-    
-    import asyncio
-    await asyncio.sleep(1.5)
-    
-    await c.message.edit_text(f"✅ Оплата прошла успешно!")
-    
-    await finalize_order_creation(c, state)
+    await finalize_order_creation(c, state, method)
 
-async def finalize_order_creation(c: CallbackQuery, state: FSMContext):
+async def finalize_order_creation(c: CallbackQuery, state: FSMContext, method: str):
     data = await state.get_data()
-    cart = data.get('cart', {})
-    store_id = data.get('current_store_id')
+    # TAKEN OUT OF THE STORE BEFORE ANY AWAIT, SO A DOUBLE TAP CAN'T CREATE A SECOND ORDER; PUT BACK IF ANYTHING FAILS
+    cart = cart_store.pop(c.bot.id, c.from_user.id)
     pickup_option = data.get('pickup_option')
     target_ready_at = data.get('target_ready_at')
+
+    if not cart:
+        await c.answer("Ваша корзина пуста.", show_alert=True)
+        return
     
+    payment_created = False
     try:
         with SessionLocal() as session:
-            total_sum = 0
-            for item_id, quantity in cart.items():
-                item = session.query(Category).filter(Category.id == int(item_id)).first()
-                if item:
-                    total_sum += item.price * quantity
-            
             new_order = Order(
                 client_id=c.from_user.id, 
-                store_id=int(store_id),
-                items=cart,
-                total_price=total_sum,
+                store_id=cart.store_id,
+                items={str(item_id): quantity for item_id, quantity in cart.items.items()},
+                total_price=cart.total,
                 pickup_option=pickup_option,
                 target_ready_at=target_ready_at,
-                payment_status='PAID',
-                status='CREATED',
+                payment_status='pending',
+                payment_key=str(uuid4()),
+                status='PENDING_PAYMENT',
+                bot_id=c.bot.id,
                 created_at=datetime.now(MSK)
             )
             
             session.add(new_order)
             session.commit()
             order_id = new_order.id
-            target_store_id = new_order.store_id
+            payment_key = new_order.payment_key
+        await mark_write(c.from_user.id)
 
-        if pickup_option == 'ASAP':
-            await notify_staff_new_order(order_id, target_store_id)
-        
-        await c.message.answer(
-            text=f'<b>Заказ №{order_id} успешно создан!</b> Мы сообщим, когда он будет готов.\n',
-            parse_mode='HTML'
-        )
+        await payment_provider.create_payment(payment_key, cart.total, method)
+        payment_created = True
         await state.clear()
+        await c.message.edit_text(f"🔄 Заказ №{order_id}: ожидаем подтверждение оплаты ({method})...")
+        await c.answer()
         
     except Exception as e:
         logger.error(f"Error finalizing order: {e}")
+        if not payment_created:
+            cart_store.restore(c.bot.id, c.from_user.id, cart)
         await c.answer("Ошибка при сохранении заказа", show_alert=True)
 
+async def confirm_order_payment(payment_key: str, succeeded: bool) -> bool:
+    with SessionLocal() as session:
+        order = repository.get_order_by_payment_key(session, payment_key)
+
+        if order and succeeded and order.payment_status == 'EXPIRED':
+            # THE CUSTOMER WAS CHARGED FOR AN ORDER ALREADY CANCELLED; REFUNDS ARE ISSUED BY HAND FROM REFUND_PENDING
+            order.payment_status = 'REFUND_PENDING'
+            enqueue_message(
+                session,
+                dedup_key=f'order_refund:{order.id}',
+                chat_id=order.client_id,
+                text=f'Оплата заказа №{order.id} поступила после его отмены. Мы вернем деньги. Оформить новый заказ: /new',
+                bot_id=order.bot_id
+            )
+            session.commit()
+            metrics.inc('payments.refund_pending')
+            logger.error(f'Order {order.id} was paid after it expired, refund needed.')
+            wake_dispatcher()
+            return True
+
+        # REPEATED OR LATE CALLBACKS NEVER MOVE THE PAYMENT BACKWARDS
+        if not order or order.payment_status != 'pending':
+            return False
+
+        metrics.inc('payments.succeeded' if succeeded else 'payments.failed')
+        if succeeded:
+            order.payment_status = 'PAID'
+            set_order_status(session, order, 'CREATED')
+            if order.pickup_option == 'ASAP':
+                notify_staff_new_order(session, order)
+            text = f'✅ Оплата прошла успешно!\n\n<b>Заказ №{order.id} успешно создан!</b> Мы сообщим, когда он будет готов.\n'
+        else:
+            order.payment_status = 'FAILED'
+            set_order_status(session, order, 'CANCELLED')
+            text = f'Оплата заказа №{order.id} не прошла. Попробуйте оформить заказ еще раз: /new'
+
+        enqueue_message(
+            session,
+            dedup_key=f'order_payment:{order.id}',
+            chat_id=order.client_id,
+            text=text,
+            parse_mode='HTML',
+            bot_id=order.bot_id
+        )
+        session.commit()
+        await mark_write(order.client_id)
+
+    wake_dispatcher()
+    return True
+
+payment_provider = create_payment_provider(on_result=confirm_order_payment)
+
+async def expire_unpaid_orders():
+    try:
+        with SessionLocal() as session:
+            now = datetime.now(MSK)
+            expired = repository.expire_unpaid_orders(session, now - OPEN_ORDERS_HORIZON, now - UNPAID_ORDER_TIMEOUT)
+            for order in expired:
+                enqueue_message(
+                    session,
+                    dedup_key=f'order_payment_expired:{order.id}',
+                    chat_id=order.client_id,
+                    text=f'Заказ №{order.id} отменен: оплата не поступила за {UNPAID_ORDER_TIMEOUT.seconds // 60} минут. Оформить новый заказ: /new',
+                    bot_id=order.bot_id
+                )
+            session.commit()
+
+        if expired:
+            wake_dispatcher()
+    except Exception as e:
+        logger.error(f'Error expiring unpaid orders: {e}')
+
 @router.callback_query(F.data=='cancel')
 @router.message(Command('cancel'))
 async def handle_cancel(event: Union[Message, CallbackQuery], state: FSMContext):
     msg = event if isinstance(event, Message) else event.message
     
+    cart_store.clear(event.bot.id, event.from_user.id)
     await state.clear()
     
     if isinstance(event, CallbackQuery):
@@ -512,17 +635,16 @@ async def back_to_menu(c: CallbackQuery, state: FSMContext):
         await render_menu(c, state, store_id)
     
 async def render_menu(c: CallbackQuery, state: FSMContext, store_id: str):
-    data = await state.get_data()
-    cart = data.get('cart', {})
-    total_items = sum(cart.values())
+    cart = cart_store.get(c.bot.id, c.from_user.id)
+    total_items = cart.count if cart and cart.store_id == int(store_id) else 0
 
     msg = 'Меню: '
     builder = InlineKeyboardBuilder()
     cart_btn_text = f'Корзина ({total_items})' if total_items > 0 else 'Корзина'
     
     try:
-        with SessionLocal() as session:
-            items = session.query(Category).filter(Category.store_id==store_id).all()
+        with read_session(c.from_user.id) as session:
+            items = repository.get_menu(session, int(store_id), tenant_id(c.bot))
 
             if not items:
                 await c.answer('Пусто.', show_alert=True)
@@ -533,10 +655,11 @@ async def render_menu(c: CallbackQuery, state: FSMContext, store_id: str):
                 builder.add(InlineKeyboardButton(text=item.name, style='success', callback_data=f'add:{item.id}'))
             
             builder.adjust(3)
+            builder.row(InlineKeyboardButton(text='🔍 Поиск', switch_inline_query_current_chat=''))
             builder.row(InlineKeyboardButton(text=cart_btn_text, style='primary', callback_data='view_cart'))
             builder.row(InlineKeyboardButton(text='Отменить заказ', style='danger', callback_data='cancel'))
             
-            await bot.edit_message_text(
+            await c.bot.edit_message_text(
                 text=msg,
                 chat_id=c.message.chat.id,
                 message_id=c.message.message_id,
@@ -546,7 +669,7 @@ async def render_menu(c: CallbackQuery, state: FSMContext, store_id: str):
 
     except Exception as e:
         logger.error(f'Error listing items: {e}')
-        await bot.edit_message_text(
+        await c.bot.edit_message_text(
             text='Ошибка загрузки меню. Попробуйте еще раз.',
             chat_id=c.message.chat.id,
             message_id=c.message.message_id
@@ -561,7 +684,7 @@ async def start_worker_session(m: Message, state: FSMContext):
         telegram_id = m.from_user.id
         
         with SessionLocal() as session:
-            existing_worker = session.query(Staff).filter(Staff.user_id == telegram_id).first()
+            existing_worker = repository.get_staff_by_user(session, telegram_id)
             if existing_worker:
                 builder.add(
                     InlineKeyboardButton(text='Да', style='success', callback_data=f'start_session:{telegram_id}'),
@@ -588,7 +711,7 @@ async def close_worker_session(m: Message, state: FSMContext):
         telegram_id = m.from_user.id
         
         with SessionLocal() as session:
-            existing_worker = session.query(Staff).filter(Staff.user_id == telegram_id).first()
+            existing_worker = repository.get_staff_by_user(session, telegram_id)
             if existing_worker:
                 builder.add(
                     InlineKeyboardButton(text='Да', style='success', callback_data=f'stop_session:{telegram_id}'),
@@ -611,7 +734,7 @@ async def close_worker_session(m: Message, state: FSMContext):
 async def process_stop_session(c: CallbackQuery, state: FSMContext):
     try:
         with SessionLocal() as session:
-            worker = session.query(Staff).filter(Staff.user_id == c.from_user.id).first()
+            worker = repository.get_staff_by_user(session, c.from_user.id)
             if worker:
                 worker.status = 'inactive'
                 session.commit()
@@ -629,24 +752,24 @@ async def waiting_for_orders(c: CallbackQuery, state: FSMContext):
     
     try:
         with SessionLocal() as session:
-            now = datetime.now(MSK)
-            alert_window = now + timedelta(minutes=15)
-            
-            worker = session.query(Staff).filter(Staff.user_id == c.from_user.id).first()
+            worker = repository.get_staff_by_user(session, c.from_user.id)
+            if not worker:
+                await c.answer('Доступ запрещен. Вы не являетесь сотрудником.', show_alert=True)
+                return
             
-            if worker:
+            if worker.status != 'active':
                 worker.status = 'active'
                 session.commit()
+            store_id = worker.store_id
+
+        with read_session(c.from_user.id, max_lag=STAFF_READ_MAX_LAG) as session:
+            now = datetime.now(MSK)
+            alert_window = now + timedelta(minutes=15)
                 
-            pending_orders = session.query(Order).filter(
-                Order.status == 'CREATED',
-                or_ (
-                    Order.pickup_option == 'ASAP',
-                    Order.target_ready_at <= alert_window
-                )
-            ).order_by(Order.created_at.asc()).all()
+            pending_orders = repository.list_pending_orders(session, store_id, now - OPEN_ORDERS_HORIZON, alert_window)
             
             if not pending_orders:
+                builder.row(InlineKeyboardButton(text='Очередь приготовления', style='primary', callback_data='prep_queue'))
                 builder.row(InlineKeyboardButton(text='Закончить смену', style='danger', callback_data='stop_session:'))
                 
                 await c.message.edit_text(
@@ -667,6 +790,7 @@ async def waiting_for_orders(c: CallbackQuery, state: FSMContext):
                 ))
         
         builder.adjust(1)
+        builder.row(InlineKeyboardButton(text='Очередь приготовления', style='primary', callback_data='prep_queue'))
         builder.row(InlineKeyboardButton(text='Закончить смену', style='danger', callback_data='stop_session:'))
 
         await c.message.edit_text(
@@ -680,6 +804,43 @@ async def waiting_for_orders(c: CallbackQuery, state: FSMContext):
         logger.error(f'Error in waiting_for_orders: {e}')
         await c.answer('Ошибка при получении списка заказов.', show_alert=True)
     
+@router.message(Command('prep'))
+@router.callback_query(F.data == 'prep_queue')
+async def show_prep_queue(event: Union[Message, CallbackQuery], state: FSMContext):
+    is_callback = isinstance(event, CallbackQuery)
+    msg_obj = event.message if is_callback else event
+    builder = InlineKeyboardBuilder()
+
+    try:
+        with read_session(event.from_user.id, max_lag=STAFF_READ_MAX_LAG) as session:
+            store_id = repository.get_staff_store_id(session, event.from_user.id)
+            if store_id is None:
+                await msg_obj.answer('Доступ запрещен. Вы не являетесь сотрудником.')
+                return
+
+            queue = repository.get_prep_queue(session, store_id)
+
+        msg_text = '<b>Очередь приготовления:</b>'
+        if queue:
+            for name, quantity in queue:
+                msg_text += f'\n{quantity}× {name}'
+        else:
+            msg_text += '\nПусто.'
+        msg_text += f'\n\n<i>Обновлено в {datetime.now(MSK):%H:%M:%S}</i>'
+
+        builder.row(InlineKeyboardButton(text='Обновить', style='primary', callback_data='prep_queue'))
+        builder.row(InlineKeyboardButton(text='К списку заказов', callback_data=f'start_session:{event.from_user.id}'))
+
+        if is_callback:
+            await msg_obj.edit_text(text=msg_text, parse_mode='HTML', reply_markup=builder.as_markup())
+            await event.answer()
+        else:
+            await msg_obj.answer(text=msg_text, parse_mode='HTML', reply_markup=builder.as_markup())
+
+    except Exception as e:
+        logger.error(f'Error showing prep queue: {e}')
+        await msg_obj.answer('Ошибка. Попробуйте позже.')
+
 @router.callback_query(lambda c: c.data.startswith('accept_order:'))
 async def accept_order(c: CallbackQuery, state: FSMContext):
     order_id = int(c.data.split(':')[1])
@@ -687,31 +848,42 @@ async def accept_order(c: CallbackQuery, state: FSMContext):
     
     try:
         with SessionLocal() as session:
-            order = session.query(Order).filter(Order.id == order_id).first()
-            items = order.items
-            await state.set_state(StaffState.ISSUE_ORDER)
-            
-            if not order:
-                await c.answer("Заказ не найден.", show_alert=True)
+            store_id = repository.get_staff_store_id(session, c.from_user.id)
+            if store_id is None:
+                await c.answer('Доступ запрещен. Вы не являетесь сотрудником.', show_alert=True)
                 return
 
-            if order.status != 'CREATED':
-                await c.answer("Этот заказ уже обрабатывается другим сотрудником.", show_alert=True)
+            order = repository.claim_order(session, order_id, c.from_user.id, store_id)
+            
+            if not order:
+                existing = repository.get_order(session, order_id)
+                if existing and existing.store_id == store_id:
+                    await c.answer("Этот заказ уже обрабатывается другим сотрудником.", show_alert=True)
+                else:
+                    await c.answer("Заказ не найден.", show_alert=True)
                 return
 
-            order.status = 'ACCEPTED'
-            order.staff_id = c.from_user.id
+            # THE CLIENT ORDERED THROUGH order.bot_id, WHICH ISN'T NECESSARILY THE BOT THE STAFF MEMBER USES
+            enqueue_message(
+                session,
+                dedup_key=f'order_accepted:{order.id}',
+                chat_id=order.client_id,
+                text="<b>Ваш заказ принят!</b> Он будет готов в течение 5-15 минут.",
+                parse_mode='HTML',
+                bot_id=order.bot_id
+            )
             session.commit()
+            await mark_write(c.from_user.id)
+            wake_dispatcher()
+            await state.set_state(StaffState.ISSUE_ORDER)
+
             builder = InlineKeyboardBuilder()
             builder.button(text='Заказ готов', style='primary', callback_data=f'issue_order:{order.id}')
             
+            item_names = repository.get_item_names(session, [int(item_id) for item_id in order.items])
             for i, (item_id, quantity) in enumerate(order.items.items(), start=1):
-                item = session.query(Category).filter(Category.id == int(item_id)).first()
-                
-                if item:
-                    items_text += f"\n{i}. {item.name} <b>(x{quantity})</b>"
-                else:
-                    items_text += f"\n{i}. ID {item_id} <b>(x{quantity})</b>"
+                item_name = item_names.get(int(item_id), f'ID {item_id}')
+                items_text += f"\n{i}. {item_name} <b>(x{quantity})</b>"
                     
             await c.message.edit_text(
                 text=f"<b>Вы приняли заказ #{order_id}!</b>\nПожалуйста, приступите к выполнению.\n\n<b>Состав заказа:</b>{items_text}",
@@ -719,16 +891,6 @@ async def accept_order(c: CallbackQuery, state: FSMContext):
                 reply_markup=builder.as_markup()
             )
 
-            try:
-                client_id = order.client_id 
-                await bot.send_message(
-                    chat_id=client_id,
-                    text="<b>Ваш заказ принят!</b> Он будет готов в течение 5-15 минут.",
-                    parse_mode='HTML'
-                )
-            except Exception as notify_error:
-                logger.error(f"Failed to notify client {order.user_id}: {notify_error}")
-
             await c.answer("Заказ принят")
 
     except Exception as e:
@@ -741,14 +903,25 @@ async def issue_order(c: CallbackQuery, state: FSMContext):
     
     try:
         with SessionLocal() as session:
-            order = session.query(Order).filter(Order.id == order_id).first()
+            store_id = repository.get_staff_store_id(session, c.from_user.id)
+            order = repository.get_order(session, order_id, for_update=True)
             
-            if not order:
+            if not order or store_id is None or order.store_id != store_id:
                 await c.answer("Заказ не найден.", show_alert=True)
                 return
 
-            order.status = 'COMPLETED'
+            set_order_status(session, order, 'COMPLETED')
+            enqueue_message(
+                session,
+                dedup_key=f'order_ready:{order.id}',
+                chat_id=order.client_id,
+                text=f"✅ <b>Ваш заказ готов.</b> Номер заказа #{order_id}.",
+                parse_mode='HTML',
+                bot_id=order.bot_id
+            )
             session.commit()
+            await mark_write(c.from_user.id)
+            wake_dispatcher()
 
             builder = InlineKeyboardBuilder()
             builder.button(text='К списку заказов', style='primary', callback_data=f'start_session:{c.from_user.id}')
@@ -764,16 +937,6 @@ async def issue_order(c: CallbackQuery, state: FSMContext):
                 reply_markup=builder.as_markup()
             )
 
-            try:
-                await bot.send_message(
-                    chat_id=order.client_id,
-                    text=f"✅ <b>Ваш заказ готов.</b> Номер заказа #{order_id}.",
-                    parse_mode='HTML'
-                )
-                
-            except Exception as notify_error:
-                logger.error(f"Не удалось уведомить клиента {order.user_id}: {notify_error}")
-
             await state.set_state(StaffState.INCOMING_ORDER)
             await c.answer("Заказ выдан")
 
@@ -781,34 +944,25 @@ async def issue_order(c: CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка при выдаче заказа: {e}")
         await c.answer("Ошибка базы данных.", show_alert=True)
         
-async def notify_staff_new_order(order_id: int, store_id: int):
-    try:
-        with SessionLocal() as session:
-            active_staff = session.query(Staff).filter(
-                Staff.store_id == store_id, 
-                Staff.status == 'active'
-            ).all()
-
-            for staff in active_staff:
-                builder = InlineKeyboardBuilder()
-                builder.add(InlineKeyboardButton(
-                    text="Принять заказ", 
-                    style='success', 
-                    callback_data=f"accept_order:{order_id}"
-                ))
-                
-                try:
-                    await bot.send_message(
-                        chat_id=staff.user_id,
-                        text=f"🔔 <b>Новый заказ #{order_id}!</b>",
-                        reply_markup=builder.as_markup(),
-                        parse_mode='HTML'
-                    )
-                except Exception as e:
-                    logger.error(f"Could not notify staff {staff.user_id}: {e}")
-                    
-    except Exception as e:
-        logger.error(f"Database error in notify_staff: {e}")
+def notify_staff_new_order(session, order):
+    # created_at IS PART OF THE KEY: A RETRIED ORDER ALERTS STAFF AGAIN
+    for staff_user_id in repository.list_active_staff_ids(session, order.store_id):
+        builder = InlineKeyboardBuilder()
+        builder.add(InlineKeyboardButton(
+            text="Принять заказ", 
+            style='success', 
+            callback_data=f"accept_order:{order.id}"
+        ))
+        
+        enqueue_message(
+            session,
+            dedup_key=f'staff_new_order:{order.id}:{order.created_at.isoformat()}:{staff_user_id}',
+            chat_id=staff_user_id,
+            text=f"🔔 <b>Новый заказ #{order.id}!</b>",
+            reply_markup=builder.as_markup(),
+            parse_mode='HTML',
+            bot_id=order.bot_id
+        )
         
 async def notify_upcoming_orders():
     try:
@@ -816,14 +970,18 @@ async def notify_upcoming_orders():
             now = datetime.now(MSK)
             alert_window = now + timedelta(minutes=15)
             
-            upcoming_orders = session.query(Order).filter(
-                Order.status == 'CREATED',
-                Order.pickup_option != 'ASAP',
-                Order.target_ready_at <= alert_window,
-                Order.target_ready_at > now - timedelta(minutes=1)
-            ).all()
+            upcoming_orders = repository.list_upcoming_orders(
+                session,
+                created_after=now - OPEN_ORDERS_HORIZON,
+                alert_window=alert_window,
+                not_before=now - timedelta(minutes=1)
+            )
             
             for order in upcoming_orders:
-                await notify_staff_new_order(order.id, order.store_id)
+                notify_staff_new_order(session, order)
+            session.commit()
+
+        if upcoming_orders:
+            wake_dispatcher()
     except Exception as e:
-        logger.error(f'Error in upcoming notifications: {e}')
\ No newline at end of file
+        logger.error(f'Error in upcoming notifications: {e}')
@@ -1,10 +1,29 @@
 import logging
 import sys
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
 from app.config import TOKEN
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
\ No newline at end of file
+dp = Dispatcher()
+_api_session = None
+_bot = None
+
+def get_api_session() -> AiohttpSession:
+    # ONE CONNECTION POOL FOR EVERY BOT IN THE PROCESS
+    global _api_session
+    if _api_session is None:
+        _api_session = AiohttpSession()
+    return _api_session
+
+def get_bot() -> Bot:
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=TOKEN, session=get_api_session())
+    return _bot
+
+async def close_bot():
+    if _api_session is not None:
+        await _api_session.close()
@@ -0,0 +1,27 @@
+from collections import defaultdict
+
+counters = defaultdict(int)
+timings = {}
+
+def inc(name: str, value: int = 1):
+    counters[name] += value
+
+def observe(name: str, seconds: float):
+    stats = timings.get(name)
+    if stats is None:
+        timings[name] = {'count': 1, 'total': seconds, 'max': seconds, 'last': seconds}
+        return
+
+    stats['count'] += 1
+    stats['total'] += seconds
+    stats['max'] = max(stats['max'], seconds)
+    stats['last'] = seconds
+
+def snapshot() -> dict:
+    return {
+        'counters': dict(counters),
+        'timings': {
+            name: {**stats, 'avg': stats['total'] / stats['count']}
+            for name, stats in timings.items()
+        },
+    }
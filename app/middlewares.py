@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, InlineQuery
+
+from app.config import THROTTLE_RATE, THROTTLE_BURST, STAFF_THROTTLE_RATE, STAFF_THROTTLE_BURST, MAX_EVENT_LOOP_LAG, MAX_IN_FLIGHT_UPDATES
+from app.models.routing import load_write_marker
+from app import metrics
+
+# STAFF WORK IS NEVER THROTTLED OR SHED, CUSTOMER BROWSING DEGRADES FIRST
+STAFF_CALLBACK_PREFIXES = ('accept_order:', 'issue_order:', 'start_session:', 'stop_session:', 'prep_queue')
+STAFF_COMMANDS = ('/start_session', '/close_session', '/prep')
+MAX_BUCKETS = 100_000
+
+def is_staff_critical(event) -> bool:
+    if isinstance(event, CallbackQuery):
+        return (event.data or '').startswith(STAFF_CALLBACK_PREFIXES)
+    if isinstance(event, Message) and event.text:
+        command = event.text.split(maxsplit=1)[0].split('@')[0]
+        return command in STAFF_COMMANDS
+    return False
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict() # USER ID -> [TOKENS, LAST REFILL], LEAST RECENTLY SEEN FIRST
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                # THE LEAST RECENTLY SEEN USER'S BUCKET HAS MOST LIKELY REFILLED, AND A FULL BUCKET BEHAVES EXACTLY LIKE A NEW ONE
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[user_id] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(user_id)
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+
+        bucket[0] -= 1
+        return True
+
+class LoadMonitor:
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag = 0.0
+        self.in_flight = 0
+
+    @property
+    def overloaded(self) -> bool:
+        return self.lag > MAX_EVENT_LOOP_LAG or self.in_flight > MAX_IN_FLIGHT_UPDATES
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            metrics.observe('event_loop.lag', self.lag)
+
+load_monitor = LoadMonitor()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.buckets = TokenBuckets(THROTTLE_RATE, THROTTLE_BURST)
+        self.staff_buckets = TokenBuckets(STAFF_THROTTLE_RATE, STAFF_THROTTLE_BURST)
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        # STAFF COMMANDS ARE RECOGNISED BY TEXT, NOT BY WHO SENDS THEM, SO THEY ARE NEVER SHED BUT STILL LIMITED
+        buckets = self.staff_buckets
+        if not is_staff_critical(event):
+            if load_monitor.overloaded:
+                metrics.inc('throttle.shed')
+                await self.reject(event, 'Сейчас много заказов, попробуйте через несколько секунд.')
+                return
+            buckets = self.buckets
+
+        if user and not buckets.allow(user.id):
+            metrics.inc('throttle.limited')
+            await self.reject(event, 'Слишком много запросов, подождите немного.')
+            return
+
+        load_monitor.in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            load_monitor.in_flight -= 1
+
+    async def reject(self, event, text: str):
+        # ONLY THE CHEAPEST POSSIBLE REPLY: NO DATABASE, NO MESSAGE EDITS
+        try:
+            if isinstance(event, CallbackQuery):
+                await event.answer(text)
+            elif isinstance(event, InlineQuery):
+                await event.answer(results=[], cache_time=1, is_personal=True)
+        except Exception:
+            pass
+
+class ReadYourWritesMiddleware(BaseMiddleware):
+    # LOADS THE USER'S WRITE MARKER ONCE PER UPDATE, SO read_session CAN KEEP THEIR READS ON THE PRIMARY
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user:
+            await load_write_marker(user.id)
+        return await handler(event, data)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    # INNER MIDDLEWARE: RUNS ONCE THE HANDLER IS RESOLVED, SO THE TIMING IS PER HANDLER, NOT PER UPDATE
+    def __init__(self, record=metrics.observe):
+        self.record = record
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.record(f"handler.{data['handler'].callback.__name__}", time.perf_counter() - started)
@@ -0,0 +1,202 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from app.models.models import get_engine
+from app.models.partitions import add_months, create_order_partition, ensure_order_partitions
+from app.loader import logger
+
+# RUNS BEFORE EVERY RESTART, SEE .github/workflows/deploy.yml:
+#     uv run python -m app.models.migrations
+# EVERY STEP IS IDEMPOTENT; APPLIED VERSIONS ARE RECORDED IN schema_migrations
+MIGRATIONS_LOCK_KEY = 727002
+
+def create_base_tables(conn):
+    # THE PRE-MIGRATION SCHEMA; A NO-OP ON EXISTING DATABASES, SETS UP A FRESH ONE
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS users ("
+        "id SERIAL PRIMARY KEY, telegram_id BIGINT NOT NULL UNIQUE, username VARCHAR NOT NULL, first_name VARCHAR)"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS stores ("
+        "id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL, address VARCHAR(255) NOT NULL, "
+        "opening_time TIME WITHOUT TIME ZONE NOT NULL, closing_time TIME WITHOUT TIME ZONE NOT NULL)"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS categories ("
+        "id SERIAL PRIMARY KEY, name VARCHAR NOT NULL, price NUMERIC, store_id INTEGER)"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS staff ("
+        "id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, store_id INTEGER NOT NULL, "
+        "role VARCHAR NOT NULL, status VARCHAR NOT NULL)"
+    ))
+
+def partition_orders(conn):
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.orders')")).scalar()
+    if relkind == 'p':
+        return
+
+    if relkind == 'r':
+        # A PLAIN TABLE CAN'T BE CONVERTED IN PLACE: KEEP IT AS orders_unpartitioned AND COPY ITS ROWS OVER
+        conn.execute(text('ALTER TABLE orders RENAME TO orders_unpartitioned'))
+        conn.execute(text('ALTER INDEX IF EXISTS orders_pkey RENAME TO orders_unpartitioned_pkey'))
+        conn.execute(text('ALTER SEQUENCE IF EXISTS orders_id_seq OWNED BY NONE'))
+
+    conn.execute(text('CREATE SEQUENCE IF NOT EXISTS orders_id_seq'))
+    conn.execute(text(
+        "CREATE TABLE orders ("
+        "id INTEGER NOT NULL DEFAULT nextval('orders_id_seq'), "
+        "client_id INTEGER NOT NULL, "
+        "store_id INTEGER NOT NULL, "
+        "items JSONB NOT NULL, "
+        "total_price NUMERIC, "
+        "pickup_option VARCHAR NOT NULL, "
+        "target_ready_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "payment_status VARCHAR NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "PRIMARY KEY (id, created_at)"
+        ") PARTITION BY RANGE (created_at)"
+    ))
+    conn.execute(text('ALTER SEQUENCE orders_id_seq OWNED BY orders.id'))
+    conn.execute(text(
+        "CREATE INDEX ix_orders_open_target_ready_at ON orders (target_ready_at) WHERE status = 'CREATED'"
+    ))
+
+    last_month = add_months(date.today().replace(day=1), 2)
+    if relkind != 'r':
+        month = date.today().replace(day=1)
+    else:
+        oldest, newest = conn.execute(text('SELECT min(created_at), max(created_at) FROM orders_unpartitioned')).first()
+        month = (oldest.date() if oldest else date.today()).replace(day=1)
+        if newest and newest.date() > last_month:
+            last_month = newest.date().replace(day=1)
+
+    while month <= last_month:
+        create_order_partition(conn, month)
+        month = add_months(month, 1)
+
+    if relkind == 'r':
+        copied = conn.execute(text(
+            "INSERT INTO orders (id, client_id, store_id, items, total_price, pickup_option, "
+            "target_ready_at, payment_status, status, created_at) "
+            "SELECT id, client_id, store_id, items, total_price, pickup_option, "
+            "target_ready_at, payment_status, status, created_at FROM orders_unpartitioned"
+        )).rowcount
+        conn.execute(text("SELECT setval('orders_id_seq', GREATEST((SELECT max(id) FROM orders), 1))"))
+        logger.info(f'Copied {copied} orders into the partitioned table; drop orders_unpartitioned once verified.')
+
+def add_order_and_store_columns(conn):
+    conn.execute(text('ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_key VARCHAR'))
+    conn.execute(text('ALTER TABLE orders ADD COLUMN IF NOT EXISTS staff_id BIGINT'))
+    conn.execute(text('ALTER TABLE orders ADD COLUMN IF NOT EXISTS bot_id BIGINT'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_orders_payment_key ON orders (payment_key)'))
+    conn.execute(text('ALTER TABLE stores ADD COLUMN IF NOT EXISTS tenant_id BIGINT'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_stores_tenant_id ON stores (tenant_id)'))
+
+def create_service_tables(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        "id BIGSERIAL PRIMARY KEY, "
+        "dedup_key VARCHAR NOT NULL UNIQUE, "
+        "chat_id BIGINT NOT NULL, "
+        "bot_id BIGINT, "
+        "payload JSONB NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "attempts INTEGER NOT NULL, "
+        "available_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "sent_at TIMESTAMP WITHOUT TIME ZONE"
+        ")"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_pending_available_at ON outbox (available_at) WHERE status = 'PENDING'"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS bot_settings (key VARCHAR PRIMARY KEY, value VARCHAR NOT NULL)"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS prep_queue ("
+        "store_id INTEGER NOT NULL, item_id INTEGER NOT NULL, quantity INTEGER NOT NULL, "
+        "PRIMARY KEY (store_id, item_id))"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS processed_updates ("
+        "bot_id BIGINT NOT NULL, update_id BIGINT NOT NULL, PRIMARY KEY (bot_id, update_id))"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS tenants ("
+        "id BIGINT PRIMARY KEY, name VARCHAR(255) NOT NULL, token VARCHAR NOT NULL, "
+        "webhook_secret VARCHAR, active BOOLEAN NOT NULL)"
+    ))
+    # OPEN ORDERS FROM BEFORE THE UPGRADE ARE ALREADY IN THE KITCHEN
+    conn.execute(text(
+        "INSERT INTO prep_queue (store_id, item_id, quantity) "
+        "SELECT o.store_id, i.key::int, sum(i.value::int) "
+        "FROM orders o, jsonb_each_text(o.items) i "
+        "WHERE o.status IN ('CREATED', 'ACCEPTED') "
+        "GROUP BY o.store_id, i.key::int "
+        "ON CONFLICT DO NOTHING"
+    ))
+
+def add_trigram_index(conn):
+    available = conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if not available:
+        # INLINE SEARCH STILL WORKS FROM THE IN-MEMORY INDEX; THE STEP IS RETRIED ON THE NEXT DEPLOY
+        logger.warning('pg_trgm is not available on this server, trigram index skipped.')
+        return False
+
+    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_categories_name_trgm ON categories USING gin (name gin_trgm_ops)'
+    ))
+
+def add_pending_payment_index(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_pending_payment_created_at ON orders (created_at) "
+        "WHERE status = 'PENDING_PAYMENT'"
+    ))
+
+def add_queued_orders_index(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_queued_store_id ON orders (store_id) "
+        "WHERE status IN ('CREATED', 'ACCEPTED')"
+    ))
+
+MIGRATIONS = [
+    (1, create_base_tables),
+    (2, partition_orders),
+    (3, add_order_and_store_columns),
+    (4, create_service_tables),
+    (5, add_trigram_index),
+    (6, add_pending_payment_index),
+    (7, add_queued_orders_index),
+]
+
+def migrate():
+    # ONE TRANSACTION: A FAILED DEPLOY LEAVES THE SCHEMA AS IT WAS
+    with get_engine().begin() as conn:
+        conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATIONS_LOCK_KEY})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        applied = set(conn.execute(text('SELECT version FROM schema_migrations')).scalars().all())
+
+        for version, step in MIGRATIONS:
+            if version in applied:
+                continue
+
+            logger.info(f'Applying migration {version} {step.__name__}')
+            if step(conn) is False:
+                continue
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, name) VALUES (:version, :name)'),
+                {'version': version, 'name': step.__name__}
+            )
+
+    ensure_order_partitions()
+
+if __name__ == '__main__':
+    migrate()
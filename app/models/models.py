@@ -1,12 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Numeric, DateTime, Time, ForeignKey, func, BigInteger
+from sqlalchemy import create_engine, Column, Integer, String, Numeric, DateTime, Time, ForeignKey, func, BigInteger, Boolean, Index, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 
 from app.config import *
 
-engine = create_engine(DATABASE_URL)
 base = declarative_base()
+_engine = None
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL)
+    return _engine
+
+class LazySession(Session):
+    # THE ENGINE IS ONLY CREATED WHEN THE FIRST SESSION IS OPENED
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or get_engine(), **kwargs)
 
 class User(base):
     __tablename__ = 'users'
@@ -16,10 +27,20 @@ class User(base):
     username = Column(String, nullable=False)
     first_name = Column(String)
     
+class Tenant(base):
+    __tablename__ = 'tenants'
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=False) # TELEGRAM BOT ID, THE PART OF THE TOKEN BEFORE ':'
+    name = Column(String(255), nullable=False)
+    token = Column(String, nullable=False)
+    webhook_secret = Column(String) # SHA-256 OF THE TOKEN WHEN EMPTY
+    active = Column(Boolean, nullable=False, default=True)
+
 class Store(base):
     __tablename__ = 'stores'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(BigInteger, index=True) # NULL IN SINGLE-BOT DEPLOYMENTS
     name = Column(String(255), nullable=False)
     address = Column(String(255), nullable=False)
     opening_time = Column(Time, nullable=False)
@@ -33,6 +54,13 @@ class Store(base):
 
 class Order(base):
     __tablename__ = 'orders'
+    # MONTHLY RANGE PARTITIONS ON created_at, SEE app/models/partitions.py
+    __table_args__ = (
+        Index('ix_orders_open_target_ready_at', 'target_ready_at', postgresql_where=text("status = 'CREATED'")),
+        Index('ix_orders_pending_payment_created_at', 'created_at', postgresql_where=text("status = 'PENDING_PAYMENT'")),
+        Index('ix_orders_queued_store_id', 'store_id', postgresql_where=text("status IN ('CREATED', 'ACCEPTED')")),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, nullable=False)
@@ -41,12 +69,19 @@ class Order(base):
     total_price = Column(Numeric)
     pickup_option = Column(String, nullable=False) # ASAP, 30, 45, 60, CUSTOM
     target_ready_at = Column(DateTime, nullable=False) # 15 MINUTES DELAY FOR ASAP; + 30/45/60 MINUTES; E.G. HH:MM + DATE FOR CUSTOM
-    payment_status = Column(String, nullable=False, default='pending')
-    status = Column(String, nullable=False) # CREATED; IN_PROGRESS; READY; COMPLETED; CANCELLED;
-    created_at = Column(DateTime, nullable=False)
+    payment_status = Column(String, nullable=False, default='pending') # pending; PAID; FAILED; EXPIRED; REFUND_PENDING (PAID AFTER EXPIRY);
+    payment_key = Column(String, index=True) # IDEMPOTENCY KEY SHARED WITH THE PAYMENT PROVIDER
+    status = Column(String, nullable=False) # PENDING_PAYMENT; CREATED; IN_PROGRESS; READY; COMPLETED; CANCELLED;
+    staff_id = Column(BigInteger) # TELEGRAM ID OF THE STAFF MEMBER WHO ACCEPTED THE ORDER
+    bot_id = Column(BigInteger) # THE BOT THE ORDER WAS PLACED THROUGH, NOTIFICATIONS GO OUT VIA THE SAME BOT
+    created_at = Column(DateTime, primary_key=True, nullable=False) # PARTITION KEY MUST BE PART OF THE PRIMARY KEY
 
 class Category(base):
     __tablename__ = 'categories'
+    # BACKS INLINE SEARCH FOR CATALOGS TOO LARGE FOR THE IN-MEMORY INDEX, NEEDS CREATE EXTENSION pg_trgm
+    __table_args__ = (
+        Index('ix_categories_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
@@ -62,4 +97,41 @@ class Staff(base):
     role = Column(String, nullable=False)
     status = Column(String, nullable=False, default='inactive')
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+class PrepQueueItem(base):
+    __tablename__ = 'prep_queue'
+    
+    store_id = Column(Integer, primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0) # SUM OVER CREATED AND ACCEPTED ORDERS, KEPT BY app/prep_queue.py
+
+class OutboxMessage(base):
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        Index('ix_outbox_pending_available_at', 'available_at', postgresql_where=text("status = 'PENDING'")),
+    )
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    dedup_key = Column(String, unique=True, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    bot_id = Column(BigInteger) # SENDING BOT; NULL MEANS THE DEFAULT BOT
+    payload = Column(JSONB, nullable=False) # text, parse_mode, reply_markup FOR bot.send_message
+    status = Column(String, nullable=False, default='PENDING') # PENDING; SENT; FAILED;
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+class ProcessedUpdate(base):
+    __tablename__ = 'processed_updates'
+    
+    # update_id SEQUENCES ARE PER BOT
+    bot_id = Column(BigInteger, primary_key=True)
+    update_id = Column(BigInteger, primary_key=True)
+
+class BotSetting(base):
+    __tablename__ = 'bot_settings'
+    
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+SessionLocal = sessionmaker(class_=LazySession, autocommit=False, autoflush=False)
\ No newline at end of file
@@ -0,0 +1,74 @@
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, text
+
+from app.models.models import get_engine
+from app.loader import logger
+
+ARCHIVE_SCHEMA = 'archive'
+FINISHED_STATUSES = ('COMPLETED', 'CANCELLED')
+PARTITION_NAME_RE = re.compile(r'^orders_(\d{4})_(\d{2})$')
+# OPEN ORDERS ARE CANCELLED WITHIN A DAY OF CREATION, SO THE HOT QUERIES ONLY TOUCH RECENT PARTITIONS
+OPEN_ORDERS_HORIZON = timedelta(days=2)
+
+def add_months(d: date, months: int) -> date:
+    month_index = d.year * 12 + d.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f'orders_{month:%Y_%m}'
+
+def create_order_partition(conn, month: date):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF orders "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+
+def ensure_order_partitions(months_ahead: int = 2):
+    current_month = date.today().replace(day=1)
+
+    try:
+        with get_engine().begin() as conn:
+            for i in range(months_ahead + 1):
+                create_order_partition(conn, add_months(current_month, i))
+    except Exception as e:
+        logger.error(f'Error creating order partitions: {e}')
+
+def archive_order_partitions(keep_months: int = 3):
+    cutoff = add_months(date.today().replace(day=1), -keep_months)
+
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}'))
+            partitions = conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'orders'::regclass"
+            )).scalars().all()
+    except Exception as e:
+        logger.error(f'Error listing order partitions: {e}')
+        return
+
+    for name in sorted(partitions):
+        match = PARTITION_NAME_RE.match(name)
+        if not match or date(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+            continue
+
+        try:
+            with get_engine().begin() as conn:
+                has_open_orders = conn.execute(
+                    text(f'SELECT EXISTS (SELECT 1 FROM {name} WHERE status NOT IN :finished)')
+                    .bindparams(bindparam('finished', expanding=True)),
+                    {'finished': list(FINISHED_STATUSES)}
+                ).scalar()
+
+                if has_open_orders:
+                    logger.warning(f'Partition {name} still has unfinished orders, not archived.')
+                    continue
+
+                conn.execute(text(f'ALTER TABLE orders DETACH PARTITION {name}'))
+                conn.execute(text(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}'))
+                logger.info(f'Partition {name} archived to {ARCHIVE_SCHEMA}.')
+        except Exception as e:
+            logger.error(f'Error archiving partition {name}: {e}')
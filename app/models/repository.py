@@ -0,0 +1,158 @@
+from sqlalchemy import select, update, bindparam, or_
+
+from app.models.models import User, Tenant, Store, Category, Staff, Order, PrepQueueItem
+
+# HOT STATEMENTS ARE BUILT ONCE AT IMPORT; ONLY PARAMETERS CHANGE PER CALL, SO SQLALCHEMY'S
+# COMPILED CACHE IS HIT EVERY TIME. QUERIES THAT DON'T NEED ENTITIES SELECT COLUMNS ONLY.
+
+_order_by_id = select(Order).where(Order.id == bindparam('order_id'))
+_order_by_id_for_update = _order_by_id.with_for_update()
+_order_by_payment_key_for_update = select(Order).where(Order.payment_key == bindparam('payment_key')).with_for_update()
+
+# CREATED -> ACCEPTED KEEPS THE ORDER IN THE PREP QUEUE, SO NO QUEUE DELTA IS NEEDED
+_claim_order = (
+    update(Order)
+    .where(Order.id == bindparam('order_id'), Order.store_id == bindparam('staff_store_id'), Order.status == 'CREATED')
+    .values(status='ACCEPTED', staff_id=bindparam('claimed_by'))
+    .returning(Order.id, Order.client_id, Order.store_id, Order.bot_id, Order.items)
+)
+
+_expired_orders = (
+    select(Order)
+    .where(Order.status == 'CREATED', Order.target_ready_at < bindparam('threshold'))
+    .with_for_update(skip_locked=True)
+)
+
+_pending_orders = (
+    select(Order.id, Order.created_at)
+    .where(
+        Order.status == 'CREATED',
+        Order.store_id == bindparam('store_id'),
+        Order.created_at >= bindparam('created_after'),
+        or_(Order.pickup_option == 'ASAP', Order.target_ready_at <= bindparam('alert_window'))
+    )
+    .order_by(Order.created_at.asc())
+)
+
+_upcoming_orders = select(Order.id, Order.store_id, Order.bot_id, Order.created_at).where(
+    Order.status == 'CREATED',
+    Order.pickup_option != 'ASAP',
+    Order.created_at >= bindparam('created_after'),
+    Order.target_ready_at <= bindparam('alert_window'),
+    Order.target_ready_at > bindparam('not_before')
+)
+
+_expire_unpaid_orders = (
+    update(Order)
+    .where(
+        Order.status == 'PENDING_PAYMENT',
+        Order.payment_status == 'pending',
+        Order.created_at >= bindparam('created_after'),
+        Order.created_at < bindparam('threshold')
+    )
+    .values(status='CANCELLED', payment_status='EXPIRED')
+    .returning(Order.id, Order.client_id, Order.bot_id)
+    .execution_options(synchronize_session=False)
+)
+
+_user_exists = select(User.id).where(User.telegram_id == bindparam('telegram_id')).limit(1)
+_staff_by_user = select(Staff).where(Staff.user_id == bindparam('user_id')).limit(1)
+_staff_store_by_user = select(Staff.store_id).where(Staff.user_id == bindparam('user_id')).limit(1)
+_active_staff_ids = select(Staff.user_id).where(Staff.store_id == bindparam('store_id'), Staff.status == 'active')
+_active_store_ids = select(Staff.store_id).where(Staff.status == 'active').distinct()
+_untenanted_stores = select(Store).where(Store.tenant_id.is_(None))
+_tenant_stores = select(Store).where(Store.tenant_id == bindparam('tenant_id'))
+_active_tenants = select(Tenant.id, Tenant.token, Tenant.webhook_secret).where(Tenant.active.is_(True))
+
+# A TENANT'S BOT ONLY SEES ITS OWN STORES' CATALOGS; tenant_id NONE MEANS THE STORES WITHOUT A TENANT, AS IN list_stores
+_in_tenant = Store.tenant_id.is_not_distinct_from(bindparam('tenant_id'))
+_menu = (
+    select(Category.id, Category.name, Category.price)
+    .join(Store, Store.id == Category.store_id)
+    .where(Category.store_id == bindparam('store_id'), _in_tenant)
+    .order_by(Category.id)
+)
+_menu_item = (
+    select(Category.id, Category.name, Category.price, Category.store_id)
+    .join(Store, Store.id == Category.store_id)
+    .where(Category.id == bindparam('item_id'), _in_tenant)
+)
+_tenant_store = select(Store.id).where(Store.id == bindparam('store_id'), _in_tenant)
+_item_names = select(Category.id, Category.name).where(Category.id.in_(bindparam('item_ids', expanding=True)))
+
+_prep_queue = (
+    select(Category.name, PrepQueueItem.quantity)
+    .join(Category, Category.id == PrepQueueItem.item_id)
+    .where(PrepQueueItem.store_id == bindparam('store_id'), PrepQueueItem.quantity > 0)
+    .order_by(PrepQueueItem.quantity.desc(), Category.name)
+)
+
+def get_order(session, order_id: int, for_update: bool = False) -> Order | None:
+    stmt = _order_by_id_for_update if for_update else _order_by_id
+    return session.execute(stmt, {'order_id': order_id}).scalars().first()
+
+def get_order_by_payment_key(session, payment_key: str) -> Order | None:
+    return session.execute(_order_by_payment_key_for_update, {'payment_key': payment_key}).scalars().first()
+
+def claim_order(session, order_id: int, staff_user_id: int, store_id: int):
+    # ATOMIC: OF TWO STAFF TAPPING THE SAME ORDER, EXACTLY ONE GETS A ROW BACK; STAFF OF OTHER STORES GET NONE
+    return session.execute(_claim_order, {'order_id': order_id, 'claimed_by': staff_user_id, 'staff_store_id': store_id}).first()
+
+def list_expired_orders(session, threshold) -> list:
+    return session.execute(_expired_orders, {'threshold': threshold}).scalars().all()
+
+def list_pending_orders(session, store_id: int, created_after, alert_window) -> list:
+    return session.execute(_pending_orders, {
+        'store_id': store_id,
+        'created_after': created_after,
+        'alert_window': alert_window,
+    }).all()
+
+def list_upcoming_orders(session, created_after, alert_window, not_before) -> list:
+    return session.execute(_upcoming_orders, {
+        'created_after': created_after,
+        'alert_window': alert_window,
+        'not_before': not_before,
+    }).all()
+
+def expire_unpaid_orders(session, created_after, threshold) -> list:
+    return session.execute(_expire_unpaid_orders, {'created_after': created_after, 'threshold': threshold}).all()
+
+def user_exists(session, telegram_id: int) -> bool:
+    return session.execute(_user_exists, {'telegram_id': telegram_id}).first() is not None
+
+def get_staff_by_user(session, user_id: int) -> Staff | None:
+    return session.execute(_staff_by_user, {'user_id': user_id}).scalars().first()
+
+def get_staff_store_id(session, user_id: int) -> int | None:
+    return session.execute(_staff_store_by_user, {'user_id': user_id}).scalar()
+
+def list_active_staff_ids(session, store_id: int) -> list:
+    return session.execute(_active_staff_ids, {'store_id': store_id}).scalars().all()
+
+def get_active_store_ids(session) -> set:
+    return set(session.execute(_active_store_ids).scalars().all())
+
+def list_stores(session, tenant_id: int = None) -> list:
+    # STORES WITHOUT A TENANT BELONG TO THE DEFAULT BOT, i.e. ALL OF THEM IN A SINGLE-BOT DEPLOYMENT
+    if tenant_id is None:
+        return session.execute(_untenanted_stores).scalars().all()
+    return session.execute(_tenant_stores, {'tenant_id': tenant_id}).scalars().all()
+
+def list_active_tenants(session) -> list:
+    return session.execute(_active_tenants).all()
+
+def get_menu(session, store_id: int, tenant_id: int = None) -> list:
+    return session.execute(_menu, {'store_id': store_id, 'tenant_id': tenant_id}).all()
+
+def get_menu_item(session, item_id: int, tenant_id: int = None):
+    return session.execute(_menu_item, {'item_id': item_id, 'tenant_id': tenant_id}).first()
+
+def store_in_tenant(session, store_id: int, tenant_id: int = None) -> bool:
+    return session.execute(_tenant_store, {'store_id': store_id, 'tenant_id': tenant_id}).first() is not None
+
+def get_item_names(session, item_ids) -> dict:
+    return dict(session.execute(_item_names, {'item_ids': list(item_ids)}).all())
+
+def get_prep_queue(session, store_id: int) -> list:
+    return session.execute(_prep_queue, {'store_id': store_id}).all()
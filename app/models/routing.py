@@ -0,0 +1,132 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from itertools import count
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.models.models import SessionLocal, get_engine
+from app.config import DATABASE_REPLICA_URLS, REPLICA_MAX_LAG_SECONDS, READ_YOUR_WRITES_SECONDS
+from app.loader import dp, logger
+
+LAG_CHECK_SECONDS = 5
+REPLICA_CONNECT_TIMEOUT = 2 # SECONDS; AN UNREACHABLE REPLICA MUST NOT STALL THE PROBE ROUND
+PRIMARY_LSN_SQL = text('SELECT pg_current_wal_lsn()')
+# MEASURED AGAINST THE PRIMARY: NULL (UNAVAILABLE) WHEN THE REPLICA ISN'T STREAMING, e.g. ITS WAL RECEIVER IS DISCONNECTED;
+# ZERO WHEN IT HAS REPLAYED THE PRIMARY'S LSN READ JUST BEFORE; OTHERWISE THE AGE OF THE LAST REPLAYED TRANSACTION.
+# pg_stat_wal_receiver.status IS ONLY VISIBLE TO ROLES WITH pg_read_all_stats
+LAG_SQL = text(
+    "SELECT CASE WHEN (SELECT status FROM pg_stat_wal_receiver) IS DISTINCT FROM 'streaming' THEN NULL "
+    "WHEN pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn) THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_engine(url, pool_pre_ping=True, connect_args={'connect_timeout': REPLICA_CONNECT_TIMEOUT})
+        self.lag = None
+        self.checked_at = float('-inf')
+
+    def probe(self, primary_lsn: str | None):
+        lag = None
+        if primary_lsn is not None:
+            try:
+                with self.engine.connect() as conn:
+                    lag = conn.execute(LAG_SQL, {'primary_lsn': primary_lsn}).scalar()
+                if lag is None:
+                    logger.warning(f'Replica {self.engine.url.host} is not streaming from the primary.')
+            except Exception as e:
+                logger.error(f'Replica {self.engine.url.host} is unavailable: {e}')
+        self.lag = float(lag) if lag is not None else None
+        self.checked_at = time.monotonic()
+
+    def current_lag(self) -> float | None:
+        # A MEASUREMENT MISSING FOR SEVERAL ROUNDS MEANS THE PROBE ITSELF IS STUCK
+        if time.monotonic() - self.checked_at > 3 * LAG_CHECK_SECONDS:
+            return None
+        return self.lag
+
+_replicas = None
+_round_robin = count()
+# READ-YOUR-WRITES: THE WALL-CLOCK TIME OF A USER'S LAST WRITE IS KEPT IN THE FSM STORAGE, SO IT IS SHARED BY EVERY
+# WORKER EXACTLY AS FAR AS THE FSM ITSELF IS; (USER ID, WRITTEN AT) OF THE UPDATE BEING HANDLED
+WRITE_MARKER_DESTINY = 'read_your_writes'
+_last_write = ContextVar('last_write', default=(None, 0.0))
+
+def get_replicas() -> list:
+    global _replicas
+    if _replicas is None:
+        _replicas = [Replica(url) for url in DATABASE_REPLICA_URLS]
+    return _replicas
+
+def probe_replicas():
+    primary_lsn = None
+    try:
+        with get_engine().connect() as conn:
+            primary_lsn = conn.execute(PRIMARY_LSN_SQL).scalar()
+    except Exception as e:
+        logger.error(f'Error reading the primary WAL position: {e}')
+
+    for replica in get_replicas():
+        replica.probe(primary_lsn)
+
+async def run_lag_probe():
+    # OFF THE REQUEST PATH: READS ONLY LOOK UP THE LAST MEASUREMENT
+    while True:
+        await asyncio.to_thread(probe_replicas)
+        await asyncio.sleep(LAG_CHECK_SECONDS)
+
+def write_marker_key(user_id: int) -> StorageKey:
+    # ONE MARKER PER USER ACROSS BOTS, read_session ONLY KNOWS THE USER
+    return StorageKey(bot_id=0, chat_id=user_id, user_id=user_id, destiny=WRITE_MARKER_DESTINY)
+
+async def load_write_marker(user_id: int):
+    # ONCE PER UPDATE, FROM ReadYourWritesMiddleware: A STORAGE READ, NOT A PRIMARY ROUND TRIP PER QUERY
+    if not get_replicas():
+        return
+
+    try:
+        data = await dp.storage.get_data(write_marker_key(user_id))
+    except Exception as e:
+        logger.error(f'Error loading write marker of user {user_id}: {e}')
+        data = {'written_at': time.time()}
+    _last_write.set((user_id, data.get('written_at', 0.0)))
+
+async def mark_write(user_id: int):
+    if not get_replicas():
+        return
+
+    now = time.time()
+    if _last_write.get()[0] in (None, user_id):
+        _last_write.set((user_id, now))
+    try:
+        await dp.storage.set_data(write_marker_key(user_id), {'written_at': now})
+    except Exception as e:
+        logger.error(f'Error recording write of user {user_id}: {e}')
+
+def wrote_recently(user_id: int) -> bool:
+    marked_user_id, written_at = _last_write.get()
+    return marked_user_id == user_id and time.time() - written_at < READ_YOUR_WRITES_SECONDS
+
+def pick_read_engine(user_id: int = None, max_lag: float = REPLICA_MAX_LAG_SECONDS):
+    replicas = get_replicas()
+    if not replicas:
+        return get_engine()
+
+    if user_id is not None and wrote_recently(user_id):
+        return get_engine()
+
+    start = next(_round_robin)
+    for i in range(len(replicas)):
+        replica = replicas[(start + i) % len(replicas)]
+        lag = replica.current_lag()
+        if lag is not None and lag <= max_lag:
+            return replica.engine
+
+    return get_engine()
+
+def read_session(user_id: int = None, max_lag: float = REPLICA_MAX_LAG_SECONDS) -> Session:
+    # FOR READ-ONLY WORK; FALLS BACK TO THE PRIMARY WHEN NO REPLICA IS FRESH ENOUGH
+    return SessionLocal(bind=pick_read_engine(user_id, max_lag))
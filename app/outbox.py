@@ -0,0 +1,144 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.models import SessionLocal, OutboxMessage
+from app.loader import logger
+from app.tenants import resolve_bot
+from app.config import MSK
+from app import metrics
+
+BATCH_SIZE = 50
+POLL_SECONDS = 5
+MAX_ATTEMPTS = 8
+SENT_RETENTION = timedelta(days=7)
+
+_wakeup = asyncio.Event()
+
+def enqueue_message(session, dedup_key: str, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None, parse_mode: str = None, bot_id: int = None):
+    # ADDED TO THE CALLER'S TRANSACTION, SO THE MESSAGE EXISTS IF AND ONLY IF THE STATUS CHANGE COMMITS
+    now = datetime.now(MSK)
+    payload = {'text': text}
+    if parse_mode:
+        payload['parse_mode'] = parse_mode
+    if reply_markup:
+        payload['reply_markup'] = reply_markup.model_dump(mode='json', exclude_none=True)
+
+    session.execute(
+        insert(OutboxMessage)
+        .values(dedup_key=dedup_key, chat_id=chat_id, bot_id=bot_id, payload=payload, status='PENDING', attempts=0, available_at=now, created_at=now)
+        .on_conflict_do_nothing(index_elements=['dedup_key'])
+    )
+
+def wake_dispatcher():
+    _wakeup.set()
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, 600))
+
+async def send_outbox_message(message: OutboxMessage, now: datetime):
+    payload = message.payload
+    reply_markup = payload.get('reply_markup')
+
+    bot = resolve_bot(message.bot_id)
+    if bot is None:
+        # THE TENANT WAS DEACTIVATED
+        message.status = 'FAILED'
+        metrics.inc('outbox.failed')
+        logger.error(f'Outbox message {message.id}: no active bot {message.bot_id}')
+        return
+
+    try:
+        await bot.send_message(
+            chat_id=message.chat_id,
+            text=payload['text'],
+            parse_mode=payload.get('parse_mode'),
+            reply_markup=InlineKeyboardMarkup.model_validate(reply_markup) if reply_markup else None
+        )
+        message.status = 'SENT'
+        message.sent_at = now
+        metrics.inc('outbox.sent')
+        return
+    except TelegramForbiddenError as e:
+        # THE USER BLOCKED THE BOT, RETRYING WON'T HELP
+        message.status = 'FAILED'
+        metrics.inc('outbox.failed')
+        logger.error(f'Outbox message {message.id} to {message.chat_id} rejected: {e}')
+        return
+    except TelegramRetryAfter as e:
+        delay = timedelta(seconds=e.retry_after)
+    except Exception as e:
+        logger.error(f'Outbox message {message.id} to {message.chat_id} failed: {e}')
+        delay = retry_delay(message.attempts)
+
+    message.attempts += 1
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'FAILED'
+        metrics.inc('outbox.failed')
+    else:
+        message.available_at = now + delay
+        metrics.inc('outbox.retried')
+
+async def send_chat_messages(messages: list, now: datetime):
+    # ONE CHAT'S MESSAGES GO OUT ONE AT A TIME IN id ORDER; AFTER A FAILURE THE REST WAIT WITH IT
+    for i, message in enumerate(messages):
+        await send_outbox_message(message, now)
+        if message.status == 'PENDING':
+            for later in messages[i + 1:]:
+                later.available_at = message.available_at
+            return
+
+async def dispatch_batch() -> int:
+    now = datetime.now(MSK)
+
+    with SessionLocal() as session:
+        messages = session.execute(
+            select(OutboxMessage)
+            .where(OutboxMessage.status == 'PENDING', OutboxMessage.available_at <= now)
+            .order_by(OutboxMessage.id)
+            .limit(BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        if not messages:
+            return 0
+
+        chats = defaultdict(list)
+        for message in messages:
+            chats[(message.bot_id, message.chat_id)].append(message)
+        await asyncio.gather(*(send_chat_messages(chat_messages, now) for chat_messages in chats.values()))
+        session.commit()
+
+    return len(messages)
+
+async def run_dispatcher():
+    while True:
+        try:
+            dispatched = await dispatch_batch()
+        except Exception as e:
+            logger.error(f'Error in outbox dispatcher: {e}')
+            dispatched = 0
+
+        if dispatched == BATCH_SIZE:
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+def purge_outbox():
+    with SessionLocal() as session:
+        session.execute(
+            delete(OutboxMessage).where(
+                OutboxMessage.status != 'PENDING',
+                OutboxMessage.created_at < datetime.now(MSK) - SENT_RETENTION
+            )
+        )
+        session.commit()
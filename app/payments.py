@@ -0,0 +1,55 @@
+import asyncio
+import random
+from decimal import Decimal
+from uuid import uuid4
+
+from app.loader import logger
+from app.config import PAYMENT_PROVIDER, PAYMENT_CALLBACK_SECRET, PAYMENT_STUB_LATENCY, PAYMENT_STUB_FAILURE_RATE
+from app import metrics
+
+# TERMINAL CALLBACK STATUSES AND WHETHER THE PAYMENT WENT THROUGH; INTERMEDIATE ONES DON'T MOVE THE ORDER
+PAYMENT_RESULTS = {'succeeded': True, 'failed': False, 'canceled': False}
+PAYMENT_INTERMEDIATE_STATUSES = ('pending', 'waiting_for_capture')
+
+class PaymentProvider:
+    # create_payment MUST BE IDEMPOTENT PER KEY; THE RESULT ARRIVES LATER THROUGH
+    # THE PROVIDER CALLBACK ENDPOINT, WHICH CALLS confirm_order_payment
+    async def create_payment(self, idempotency_key: str, amount: Decimal, method: str) -> str:
+        raise NotImplementedError
+
+class StubPaymentProvider(PaymentProvider):
+    # OFFLINE PROVIDER: SETTLES EVERY PAYMENT AFTER latency SECONDS, FAILING failure_rate OF THEM
+    def __init__(self, on_result, latency: float = 1.5, failure_rate: float = 0.0):
+        self.on_result = on_result
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._payments = {}
+        self._tasks = set()
+
+    async def create_payment(self, idempotency_key: str, amount: Decimal, method: str) -> str:
+        payment_id = self._payments.get(idempotency_key)
+        if payment_id:
+            return payment_id
+
+        payment_id = f'stub-{uuid4().hex}'
+        self._payments[idempotency_key] = payment_id
+        task = asyncio.create_task(self._settle(idempotency_key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        metrics.inc('payments.created')
+        return payment_id
+
+    async def _settle(self, idempotency_key: str):
+        await asyncio.sleep(self.latency)
+        succeeded = random.random() >= self.failure_rate
+        try:
+            await self.on_result(idempotency_key, succeeded)
+        except Exception as e:
+            logger.error(f'Stub payment callback for {idempotency_key} failed: {e}')
+
+def create_payment_provider(on_result) -> PaymentProvider:
+    if PAYMENT_PROVIDER != 'stub' and not PAYMENT_CALLBACK_SECRET:
+        raise ValueError('PAYMENT_CALLBACK_SECRET must be set for a real payment provider')
+    if PAYMENT_PROVIDER == 'stub':
+        return StubPaymentProvider(on_result, PAYMENT_STUB_LATENCY, PAYMENT_STUB_FAILURE_RATE)
+    raise ValueError(f'Unknown payment provider: {PAYMENT_PROVIDER}')
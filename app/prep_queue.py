@@ -0,0 +1,56 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.models import SessionLocal, Order, PrepQueueItem
+from app.loader import logger
+
+# ORDERS IN THESE STATUSES STILL HAVE TO BE PREPARED
+QUEUED_STATUSES = ('CREATED', 'ACCEPTED')
+
+def set_order_status(session, order: Order, status: str):
+    was_queued = order.status in QUEUED_STATUSES
+    order.status = status
+    is_queued = status in QUEUED_STATUSES
+
+    if was_queued == is_queued or not order.items:
+        return
+
+    sign = 1 if is_queued else -1
+    stmt = insert(PrepQueueItem).values([
+        {'store_id': order.store_id, 'item_id': int(item_id), 'quantity': sign * quantity}
+        for item_id, quantity in order.items.items()
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=['store_id', 'item_id'],
+        set_={'quantity': PrepQueueItem.quantity + stmt.excluded.quantity}
+    ))
+
+def rebuild_prep_queue():
+    # SAFETY NET AGAINST DRIFT, e.g. ORDERS CHANGED BY HAND IN THE DATABASE.
+    # ONE STATEMENT, ONE SNAPSHOT: THE TEMP TABLE HOLDS (QUEUE REBUILT FROM ORDERS) - (prep_queue AS IT WAS), AND IS
+    # ADDED ONTO prep_queue LIKE ANY OTHER DELTA, SO set_order_status DELTAS COMMITTED MEANWHILE ARE KEPT AND
+    # NO LOCK IS HELD WHILE THE ORDERS ARE SCANNED (ix_orders_queued_store_id)
+    try:
+        with SessionLocal() as session:
+            session.execute(text(
+                "CREATE TEMP TABLE prep_queue_drift ON COMMIT DROP AS "
+                "SELECT store_id, item_id, sum(quantity)::int AS quantity FROM ("
+                "SELECT o.store_id, i.key::int AS item_id, i.value::int AS quantity "
+                "FROM orders o, jsonb_each_text(o.items) i "
+                "WHERE o.status IN ('CREATED', 'ACCEPTED') "
+                "UNION ALL "
+                "SELECT store_id, item_id, -quantity FROM prep_queue"
+                ") queue GROUP BY store_id, item_id HAVING sum(quantity) <> 0"
+            ))
+            drifted = session.execute(text(
+                "INSERT INTO prep_queue (store_id, item_id, quantity) "
+                "SELECT store_id, item_id, quantity FROM prep_queue_drift "
+                "ON CONFLICT (store_id, item_id) DO UPDATE SET quantity = prep_queue.quantity + excluded.quantity"
+            )).rowcount
+            session.execute(text('DELETE FROM prep_queue WHERE quantity = 0'))
+            session.commit()
+
+        if drifted:
+            logger.warning(f'Prep queue drifted on {drifted} items, corrected.')
+    except Exception as e:
+        logger.error(f'Error rebuilding prep queue: {e}')
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import text
+
+from app.handlers.handlers import check_order_timeouts, notify_upcoming_orders, expire_unpaid_orders
+from app.models.models import get_engine
+from app.models.partitions import ensure_order_partitions, archive_order_partitions
+from app.outbox import purge_outbox
+from app.cart import cart_store
+from app.prep_queue import rebuild_prep_queue
+from app.dedup import prune_processed_updates
+from app.loader import logger
+from app import metrics
+
+SCHEDULER_LOCK_KEY = 727001 # ARBITRARY, SHARED BY ALL INSTANCES OF THE APP
+LEASE_RENEW_SECONDS = 10
+
+class LeaderElection:
+    # THE ADVISORY LOCK LIVES AS LONG AS THE HOLDING CONNECTION, SO A CRASHED
+    # OR DISCONNECTED LEADER RELEASES IT AND THE NEXT RENEWAL ELSEWHERE TAKES OVER
+    def __init__(self, lock_key: int):
+        self.lock_key = lock_key
+        self.is_leader = False
+        self._conn = None
+
+    def renew(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(text('SELECT 1'))
+                return
+            except Exception as e:
+                logger.error(f'Scheduler leader lost its lock connection: {e}')
+                self._drop()
+
+        try:
+            conn = get_engine().connect().execution_options(isolation_level='AUTOCOMMIT')
+            acquired = conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.lock_key}).scalar()
+        except Exception as e:
+            logger.error(f'Scheduler leader election failed: {e}')
+            return
+
+        if acquired:
+            self._conn = conn
+            self.is_leader = True
+            metrics.inc('scheduler.leader_acquired')
+            logger.info('This instance is now the scheduler leader.')
+        else:
+            conn.close()
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.lock_key})
+            except Exception as e:
+                logger.error(f'Error releasing scheduler lock: {e}')
+        self._drop()
+
+    def _drop(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+        self.is_leader = False
+
+election = LeaderElection(SCHEDULER_LOCK_KEY)
+
+def leader_job(name: str, func):
+    async def run():
+        if not election.is_leader:
+            return
+
+        started = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func()
+            else:
+                await asyncio.to_thread(func)
+        except Exception as e:
+            metrics.inc(f'job.{name}.failed')
+            logger.error(f'Job {name} failed: {e}')
+        finally:
+            metrics.observe(f'job.{name}.duration', time.monotonic() - started)
+
+    return run
+
+def on_job_overlap(event):
+    metrics.inc(f'job.{event.job_id}.skipped_overlap')
+    logger.warning(f'Job {event.job_id} is still running, skipping this run.')
+
+async def purge_expired_carts():
+    cart_store.purge_expired()
+
+def create_scheduler() -> AsyncIOScheduler:
+    scheduler = AsyncIOScheduler()
+    scheduler.add_listener(on_job_overlap, EVENT_JOB_MAX_INSTANCES)
+    scheduler.add_job(election.renew, 'interval', seconds=LEASE_RENEW_SECONDS, next_run_time=datetime.now())
+    # CARTS LIVE IN THIS PROCESS, SO EVERY INSTANCE PURGES ITS OWN ON THE EVENT LOOP
+    scheduler.add_job(purge_expired_carts, 'interval', minutes=10)
+
+    jobs = [
+        (check_order_timeouts, {'trigger': 'interval', 'minutes': 1}),
+        (notify_upcoming_orders, {'trigger': 'interval', 'minutes': 1}),
+        (expire_unpaid_orders, {'trigger': 'interval', 'minutes': 5}),
+        (ensure_order_partitions, {'trigger': 'cron', 'hour': 3}),
+        (archive_order_partitions, {'trigger': 'cron', 'hour': 4}),
+        (purge_outbox, {'trigger': 'cron', 'hour': 5}),
+        (rebuild_prep_queue, {'trigger': 'cron', 'hour': 2}),
+        (prune_processed_updates, {'trigger': 'interval', 'minutes': 10}),
+    ]
+    for func, trigger in jobs:
+        scheduler.add_job(
+            leader_job(func.__name__, func),
+            id=func.__name__,
+            max_instances=1,
+            coalesce=True,
+            **trigger
+        )
+
+    return scheduler
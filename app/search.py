@@ -0,0 +1,118 @@
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from sqlalchemy import func, literal_column, cast, String, or_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from app.models.models import Category
+from app.models.routing import read_session
+from app.models import repository
+
+INDEX_MAX_ITEMS = 5000 # LARGER CATALOGS ARE SEARCHED WITH pg_trgm INSTEAD OF AN IN-MEMORY INDEX
+VERSION_CHECK_SECONDS = 60
+MIN_SIMILARITY = 0.3
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+def trigrams(text: str) -> set:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class MenuIndex:
+    def __init__(self, version: str, items: list):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.items = {item.id: item for item in items}
+        self._by_name = sorted(self.items, key=lambda item_id: normalize(self.items[item_id].name))
+        self._trigrams = defaultdict(set)
+        self._words = []
+
+        for item in items:
+            name = normalize(item.name)
+            for gram in trigrams(name):
+                self._trigrams[gram].add(item.id)
+            for word in name.split():
+                self._words.append((word, item.id))
+        self._words.sort()
+
+    def _prefix_matches(self, query: str) -> set:
+        matches = set()
+        i = bisect_left(self._words, (query,))
+        while i < len(self._words) and self._words[i][0].startswith(query):
+            matches.add(self._words[i][1])
+            i += 1
+        return matches
+
+    def search(self, query: str, limit: int) -> list:
+        query = normalize(query)
+        if not query:
+            return [self.items[item_id] for item_id in self._by_name[:limit]]
+
+        prefix_ids = self._prefix_matches(query)
+        query_grams = trigrams(query)
+        overlap = Counter()
+        for gram in query_grams:
+            for item_id in self._trigrams.get(gram, ()):
+                overlap[item_id] += 1
+
+        candidates = prefix_ids | {
+            item_id for item_id, count in overlap.items()
+            if count / len(query_grams) >= MIN_SIMILARITY
+        }
+        ranked = sorted(candidates, key=lambda item_id: (item_id not in prefix_ids, -overlap[item_id], self.items[item_id].name))
+        return [self.items[item_id] for item_id in ranked[:limit]]
+
+_indexes = {}
+_large_catalogs = {} # STORE ID -> WHEN IT WAS LAST SEEN ABOVE INDEX_MAX_ITEMS
+
+def catalog_version(session, store_id: int):
+    fingerprint = cast(Category.id, String) + ':' + Category.name + ':' + func.coalesce(cast(Category.price, String), '')
+    return session.query(
+        func.count(Category.id),
+        func.md5(func.string_agg(fingerprint, aggregate_order_by(literal_column("','"), Category.id)))
+    ).filter(Category.store_id == store_id).one()
+
+def get_menu_index(session, store_id: int) -> MenuIndex | None:
+    now = time.monotonic()
+    if now - _large_catalogs.get(store_id, float('-inf')) < VERSION_CHECK_SECONDS:
+        return None
+
+    index = _indexes.get(store_id)
+    if index and now - index.checked_at < VERSION_CHECK_SECONDS:
+        return index
+
+    count, version = catalog_version(session, store_id)
+    if count > INDEX_MAX_ITEMS:
+        _indexes.pop(store_id, None)
+        _large_catalogs[store_id] = now
+        return None
+
+    if index and index.version == version:
+        index.checked_at = now
+        return index
+
+    items = session.query(Category.id, Category.name, Category.price).filter(Category.store_id == store_id).all()
+    index = _indexes[store_id] = MenuIndex(version, items)
+    return index
+
+def search_menu_items(store_id: int, query: str, tenant_id: int = None, limit: int = 20) -> list:
+    with read_session() as session:
+        if not repository.store_in_tenant(session, store_id, tenant_id):
+            return []
+
+        index = get_menu_index(session, store_id)
+        if index is not None:
+            return index.search(query, limit)
+
+        items = session.query(Category.id, Category.name, Category.price).filter(Category.store_id == store_id)
+        query = query.strip()
+        if query:
+            items = items.filter(or_(
+                Category.name.icontains(query, autoescape=True),
+                Category.name.op('%')(query)
+            )).order_by(func.similarity(Category.name, query).desc())
+        else:
+            items = items.order_by(Category.name)
+        return items.limit(limit).all()
@@ -0,0 +1,66 @@
+import hashlib
+
+from aiogram import Bot
+
+from app.models.models import SessionLocal
+from app.models import repository
+from app.loader import get_bot, get_api_session, logger
+from app.config import MULTI_TENANT, TOKEN
+
+class TenantBots:
+    # PER TENANT ONLY A TOKEN, A SECRET AND A Bot OBJECT ARE KEPT; THE HTTP SESSION AND THE DB POOL ARE SHARED
+    def __init__(self):
+        self._tenants = {} # BOT ID -> (TOKEN, WEBHOOK SECRET)
+        self._bots = {}
+
+    def load(self) -> list:
+        with SessionLocal() as session:
+            rows = repository.list_active_tenants(session)
+
+        tenants = {
+            row.id: (row.token, row.webhook_secret or hashlib.sha256(row.token.encode()).hexdigest())
+            for row in rows
+        }
+        for bot_id in list(self._bots):
+            if tenants.get(bot_id, (None,))[0] != self._tenants[bot_id][0]:
+                del self._bots[bot_id]
+
+        # NEW TENANTS AND ROTATED TOKENS OR SECRETS NEED THEIR WEBHOOK (RE)REGISTERED
+        changed = [bot_id for bot_id, tenant in tenants.items() if self._tenants.get(bot_id) != tenant]
+        self._tenants = tenants
+        if changed:
+            logger.info(f'Loaded {len(tenants)} tenants, {len(changed)} new or changed.')
+        return changed
+
+    def get(self, bot_id: int) -> Bot | None:
+        tenant = self._tenants.get(bot_id)
+        if tenant is None:
+            return None
+
+        bot = self._bots.get(bot_id)
+        if bot is None:
+            bot = self._bots[bot_id] = Bot(token=tenant[0], session=get_api_session())
+        return bot
+
+    def secret(self, bot_id: int) -> str | None:
+        tenant = self._tenants.get(bot_id)
+        return tenant[1] if tenant else None
+
+    def ids(self) -> list:
+        return list(self._tenants)
+
+    def __contains__(self, bot_id: int) -> bool:
+        return bot_id in self._tenants
+
+tenant_bots = TenantBots()
+
+def resolve_bot(bot_id: int = None) -> Bot | None:
+    # NULL bot_id (ROWS FROM BEFORE MULTI-TENANT MODE), SINGLE-BOT DEPLOYMENTS AND ORDERS PLACED THROUGH THE DEFAULT
+    # BOT ITSELF, WHICH ISN'T IN THE tenants TABLE, USE THE DEFAULT BOT
+    if MULTI_TENANT and bot_id is not None and not (TOKEN and bot_id == get_bot().id):
+        return tenant_bots.get(bot_id)
+    return get_bot()
+
+def tenant_id(bot: Bot) -> int | None:
+    # THE DEFAULT BOT (TOKEN) ISN'T A TENANT EVEN IN MULTI-TENANT MODE, IT SERVES THE STORES WITHOUT ONE
+    return bot.id if MULTI_TENANT and bot.id in tenant_bots else None
@@ -0,0 +1,67 @@
+"""Per-call overhead of the hot queries: legacy session.query(...) vs app.models.repository.
+
+Runs each pair against DATABASE_URL with ids that already exist there.
+
+    uv run python -m scripts.bench_repository --order-id 1 --staff-user-id 123 --store-id 1
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from app.config import MSK
+from app.models import repository
+from app.models.models import SessionLocal, Category, Staff, Order
+
+def timed(session, func, iterations: int) -> float:
+    func(session)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(session)
+        session.expunge_all()
+    return (time.perf_counter() - started) / iterations * 1_000_000
+
+def run(order_id: int, staff_user_id: int, store_id: int, iterations: int):
+    now = datetime.now(MSK)
+    created_after = now - timedelta(days=2)
+    alert_window = now + timedelta(minutes=15)
+
+    cases = {
+        'get order': (
+            lambda s: s.query(Order).filter(Order.id == order_id).first(),
+            lambda s: repository.get_order(s, order_id),
+        ),
+        'get staff by user': (
+            lambda s: s.query(Staff).filter(Staff.user_id == staff_user_id).first(),
+            lambda s: repository.get_staff_by_user(s, staff_user_id),
+        ),
+        'get menu': (
+            lambda s: s.query(Category).filter(Category.store_id == store_id).all(),
+            lambda s: repository.get_menu(s, store_id),
+        ),
+        'list pending': (
+            lambda s: s.query(Order).filter(
+                Order.status == 'CREATED',
+                Order.store_id == store_id,
+                Order.created_at >= created_after,
+                or_(Order.pickup_option == 'ASAP', Order.target_ready_at <= alert_window)
+            ).order_by(Order.created_at.asc()).all(),
+            lambda s: repository.list_pending_orders(s, store_id, created_after, alert_window),
+        ),
+    }
+
+    with SessionLocal() as session:
+        for name, (legacy, current) in cases.items():
+            legacy_us = timed(session, legacy, iterations)
+            current_us = timed(session, current, iterations)
+            print(f'{name}: legacy {legacy_us:.0f} us, repository {current_us:.0f} us ({legacy_us / current_us:.2f}x)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--order-id', type=int, required=True)
+    parser.add_argument('--staff-user-id', type=int, required=True)
+    parser.add_argument('--store-id', type=int, required=True)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.order_id, args.staff_user_id, args.store_id, args.iterations)
@@ -0,0 +1,101 @@
+"""Benchmark the per-minute scheduler queries against a large order history.
+
+Seeds DATABASE_URL with historical orders (COMPLETED/CANCELLED, spread over
+monthly partitions) plus a handful of open ones, then times the queries run by
+check_order_timeouts, notify_upcoming_orders and waiting_for_orders.
+
+    uv run python -m scripts.bench_scheduler_queries --orders 50000000 --months 24
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import or_, text
+
+from app.config import MSK
+from app.models.models import SessionLocal, Order, get_engine
+from app.models.partitions import OPEN_ORDERS_HORIZON, add_months, create_order_partition, ensure_order_partitions
+
+SEED_BATCH = 1_000_000
+
+def seed(total_orders: int, months: int):
+    first_month = add_months(date.today().replace(day=1), -months)
+
+    with get_engine().begin() as conn:
+        for i in range(months):
+            create_order_partition(conn, add_months(first_month, i))
+    ensure_order_partitions()
+
+    span_seconds = int((datetime.now() - datetime.combine(first_month, datetime.min.time())).total_seconds())
+    for offset in range(0, total_orders, SEED_BATCH):
+        batch = min(SEED_BATCH, total_orders - offset)
+        with get_engine().begin() as conn:
+            conn.execute(text(
+                "INSERT INTO orders (client_id, store_id, items, total_price, pickup_option, "
+                "target_ready_at, payment_status, status, created_at) "
+                "SELECT g % 100000, g % 50, '{\"1\": 1}'::jsonb, 250, 'ASAP', "
+                "ts + interval '15 minutes', 'PAID', "
+                "CASE WHEN g % 10 = 0 THEN 'CANCELLED' ELSE 'COMPLETED' END, ts "
+                "FROM (SELECT g, :start + (random() * :span) * interval '1 second' AS ts "
+                "      FROM generate_series(1, :batch) AS g) s"
+            ), {'start': first_month, 'span': span_seconds, 'batch': batch})
+        print(f'seeded {offset + batch}/{total_orders}')
+
+    now = datetime.now(MSK)
+    with SessionLocal() as session:
+        for i in range(200):
+            session.add(Order(
+                client_id=i, store_id=i % 50, items={'1': 1}, total_price=250,
+                pickup_option='ASAP' if i % 2 else '30',
+                target_ready_at=now + timedelta(minutes=i % 40 - 20),
+                payment_status='PAID', status='CREATED', created_at=now
+            ))
+        session.commit()
+
+    with get_engine().connect() as conn:
+        conn.execute(text('ANALYZE orders'))
+
+def scheduler_queries(session):
+    now = datetime.now(MSK)
+    alert_window = now + timedelta(minutes=15)
+
+    return {
+        'check_order_timeouts': session.query(Order).filter(
+            Order.status == 'CREATED',
+            Order.target_ready_at < now - timedelta(minutes=15)
+        ),
+        'notify_upcoming_orders': session.query(Order).filter(
+            Order.status == 'CREATED',
+            Order.pickup_option != 'ASAP',
+            Order.created_at >= now - OPEN_ORDERS_HORIZON,
+            Order.target_ready_at <= alert_window,
+            Order.target_ready_at > now - timedelta(minutes=1)
+        ),
+        'waiting_for_orders': session.query(Order).filter(
+            Order.status == 'CREATED',
+            Order.created_at >= now - OPEN_ORDERS_HORIZON,
+            or_(Order.pickup_option == 'ASAP', Order.target_ready_at <= alert_window)
+        ).order_by(Order.created_at.asc()),
+    }
+
+def run(iterations: int):
+    with SessionLocal() as session:
+        for name, query in scheduler_queries(session).items():
+            query.all()
+            started = time.perf_counter()
+            for _ in range(iterations):
+                query.all()
+            elapsed_ms = (time.perf_counter() - started) / iterations * 1000
+            print(f'{name}: {elapsed_ms:.3f} ms/run')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=50_000_000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(args.orders, args.months)
+    run(args.iterations)
@@ -0,0 +1,42 @@
+"""Measure cold start: interpreter import of app.app plus the FastAPI startup hook.
+
+Each run is a fresh subprocess, so nothing is shared between samples.
+
+    uv run python -m scripts.bench_startup --runs 20
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import asyncio, json, os, time
+started = time.perf_counter()
+import app.app
+imported = time.perf_counter()
+
+async def main():
+    await app.app.on_startup()
+    return time.perf_counter()
+
+ready = asyncio.run(main())
+print(json.dumps({'import_ms': (imported - started) * 1000, 'startup_ms': (ready - imported) * 1000}))
+os._exit(0)
+'''
+
+def run(runs: int):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    for key in ('import_ms', 'startup_ms'):
+        values = [sample[key] for sample in samples]
+        print(f'{key}: median {statistics.median(values):.1f} ms, max {max(values):.1f} ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+    run(args.runs)
@@ -0,0 +1,29 @@
+"""Memory cost per tenant bot in multi-tenant mode: every tenant shares one AiohttpSession.
+
+    uv run python -m scripts.bench_tenants --tenants 500
+"""
+import argparse
+import gc
+import tracemalloc
+
+from app.tenants import TenantBots
+
+def run(tenants: int):
+    registry = TenantBots()
+    registry._tenants = {bot_id: (f'{bot_id}:{"x" * 35}', f'{bot_id:064x}') for bot_id in range(1, tenants + 1)}
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for bot_id in registry.ids():
+        registry.get(bot_id)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print(f'{tenants} tenant bots: {allocated / 1024:.0f} KiB, {allocated / tenants:.0f} bytes per tenant')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tenants', type=int, default=500)
+    run(parser.parse_args().tenants)
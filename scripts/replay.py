@@ -0,0 +1,224 @@
+"""Replay captured webhook traffic against a mocked Bot API and a local DB snapshot.
+
+Capture with CAPTURE_DIR set on the production app. Restore the same snapshot
+into the local DATABASE_URL before every run, so that two builds start from the
+same state. Updates of one user are fed in their original order. Different users
+overlap as they did in production. The outbox dispatcher runs; scheduler jobs
+don't.
+
+    uv run python -m scripts.replay run captures/*.jsonl.gz --speed 10 --report new.json
+    uv run python -m scripts.replay compare base.json new.json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import count
+from typing import get_args
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+from sqlalchemy.engine import make_url
+
+import app.app as application
+from app import loader
+from app.capture import read_capture
+from app.outbox import run_dispatcher, dispatch_batch
+from app.tenants import tenant_bots
+from app.config import DATABASE_URL, DATABASE_REPLICA_URLS, MULTI_TENANT, TOKEN, PAYMENT_STUB_LATENCY
+
+LOCAL_HOSTS = (None, 'localhost', '127.0.0.1', '::1')
+
+class MockSession(BaseSession):
+    # ANSWERS EVERY BOT API CALL LOCALLY AFTER A FIXED LATENCY, SO ONLY THE APP'S OWN WORK IS MEASURED
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        if returning is Message or Message in get_args(returning):
+            chat_id = getattr(method, 'chat_id', None)
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type='private'),
+                text=getattr(method, 'text', None)
+            )
+        if returning is bool or bool in get_args(returning):
+            return True
+        return None
+
+    async def stream_content(self, *args, **kwargs):
+        for chunk in ():
+            yield chunk
+
+    async def close(self):
+        pass
+
+def check_database(allow_remote: bool):
+    # REPLAY WRITES ORDERS AND OUTBOX ROWS, AND READS MUST SEE THEM
+    if DATABASE_REPLICA_URLS:
+        raise SystemExit('Unset DATABASE_REPLICA_URLS for replay.')
+    host = make_url(DATABASE_URL).host
+    if host not in LOCAL_HOSTS and not allow_remote:
+        raise SystemExit(f'DATABASE_URL points at {host}; replay against a local snapshot or pass --allow-remote-db.')
+
+def update_user(payload: dict) -> int | None:
+    for value in payload.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return None
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+    percentile = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered) * 1000,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': ordered[-1] * 1000,
+    }
+
+async def replay(records: list, speed: float | None, api_latency: float, concurrency: int) -> dict:
+    session = MockSession(api_latency)
+    # EVERY BOT THE APP CREATES, THE OUTBOX'S INCLUDED, GOES THROUGH THE MOCK
+    loader._api_session = session
+    bots = {bot_id: Bot(token=f'{bot_id}:replay', session=session) for bot_id in {record['bot_id'] for record in records}}
+    if not TOKEN:
+        loader._bot = bots[records[0]['bot_id']]
+    if MULTI_TENANT:
+        await asyncio.to_thread(tenant_bots.load)
+
+    samples = defaultdict(list)
+    application.handler_timing.record = lambda name, seconds: samples[name].append(seconds)
+    # THE TOKEN BUCKETS SEE THE REPLAYED RATE, SO THEY ARE SCALED BY THE SAME FACTOR
+    for buckets in (application.throttling.buckets, application.throttling.staff_buckets):
+        if speed is None:
+            buckets.allow = lambda user_id: True
+        else:
+            buckets.rate *= speed
+
+    locks = defaultdict(asyncio.Lock)
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = Counter()
+
+    async def feed(record: dict):
+        payload = record['update']
+        async with locks[(record['bot_id'], update_user(payload))], semaphore:
+            started = time.perf_counter()
+            try:
+                await loader.dp.feed_webhook_update(bots[record['bot_id']], Update(**payload))
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            samples['update'].append(time.perf_counter() - started)
+
+    dispatcher = asyncio.create_task(run_dispatcher())
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first_ts = records[0]['ts']
+    tasks = []
+    for record in records:
+        if speed is not None:
+            delay = (record['ts'] - first_ts) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(record)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+
+    # LET STUB PAYMENTS SETTLE, THEN DRAIN THE OUTBOX SO EVERY RUN SENDS THE SAME MESSAGES
+    await asyncio.sleep(PAYMENT_STUB_LATENCY)
+    dispatcher.cancel()
+    while await dispatch_batch():
+        pass
+
+    return {
+        'updates': len(records),
+        'speed': speed or 'max',
+        'wall_seconds': elapsed,
+        'updates_per_second': len(records) / elapsed if elapsed else None,
+        'errors': dict(errors),
+        'update': summarize(samples.pop('update')),
+        'handlers': {name: summarize(values) for name, values in sorted(samples.items())},
+        'api_calls': dict(session.calls),
+    }
+
+def print_report(report: dict):
+    print(f"{report['updates']} updates at {report['speed']}x in {report['wall_seconds']:.1f}s, errors: {report['errors'] or 'none'}")
+    print(f"{'':40} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in [('update', report['update']), *report['handlers'].items()]:
+        print(f"{name:40} {stats['count']:>7} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f} {stats['max']:>9.2f}")
+    print('api calls:', ', '.join(f'{method} {calls}' for method, calls in sorted(report['api_calls'].items())))
+
+def change(base: float, new: float) -> str:
+    return f'{(new - base) / base * 100:+.1f}%' if base else 'n/a'
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    base_rows = {'update': base['update'], **base['handlers']}
+    new_rows = {'update': new['update'], **new['handlers']}
+    print(f"{'':40} {'base p50':>9} {'new p50':>9} {'':>8} {'base p95':>9} {'new p95':>9} {'':>8}")
+    for name in [name for name in new_rows if name in base_rows]:
+        b, n = base_rows[name], new_rows[name]
+        print(f"{name:40} {b['p50']:>9.2f} {n['p50']:>9.2f} {change(b['p50'], n['p50']):>8} {b['p95']:>9.2f} {n['p95']:>9.2f} {change(b['p95'], n['p95']):>8}")
+    for name in sorted(set(base_rows) ^ set(new_rows)):
+        print(f"{name:40} only in {'base' if name in base_rows else 'new'}")
+
+    for method in sorted(set(base['api_calls']) | set(new['api_calls'])):
+        b, n = base['api_calls'].get(method, 0), new['api_calls'].get(method, 0)
+        if b != n:
+            print(f'api calls {method}: {b} -> {n}')
+    if base['errors'] != new['errors']:
+        print(f"errors: {base['errors']} -> {new['errors']}")
+
+def run(paths: list, speed: float | None, api_latency: float, concurrency: int, report_path: str, allow_remote: bool):
+    check_database(allow_remote)
+    records = read_capture(paths)
+    if not records:
+        raise SystemExit('No captured updates.')
+
+    report = asyncio.run(replay(records, speed, api_latency, concurrency))
+    print_report(report)
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('paths', nargs='+')
+    run_parser.add_argument('--speed', type=lambda value: None if value == 'max' else float(value), default=1.0,
+                            help="1 for original timing, N for N times faster, 'max' for no pauses")
+    run_parser.add_argument('--api-latency', type=float, default=0.0, help='seconds per mocked Bot API call')
+    run_parser.add_argument('--concurrency', type=int, default=50)
+    run_parser.add_argument('--report', help='write the latency report as JSON for compare')
+    run_parser.add_argument('--allow-remote-db', action='store_true')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args.paths, args.speed, args.api_latency, args.concurrency, args.report, args.allow_remote_db)
+    else:
+        compare(args.base, args.new)
@@ -0,0 +1,86 @@
+"""Hammer the cart store with rapid parallel taps and check it stays consistent.
+
+Every simulated user fires bursts of concurrent add/remove taps. Like the real
+handlers, each tap awaits between its cart operation and its reply. Menu prices
+change in the middle of the run. After every tap the cart's total and count
+must match its lines, and at the end each cart must equal the sequential sum of
+its taps.
+
+    uv run python -m scripts.stress_cart --users 200 --taps 500
+"""
+import argparse
+import asyncio
+import random
+import sys
+from decimal import Decimal
+
+from app.cart import CartStore
+
+BOT_ID = 1
+STORE_ID = 1
+
+def check(cart, user_id: int) -> list:
+    if cart is None:
+        return []
+    errors = []
+    total = sum(cart.prices[item_id] * quantity for item_id, quantity in cart.items.items())
+    if total != cart.total:
+        errors.append(f'user {user_id}: total {cart.total} != lines {total}')
+    if sum(cart.items.values()) != cart.count:
+        errors.append(f'user {user_id}: count {cart.count} != lines {sum(cart.items.values())}')
+    if any(quantity <= 0 for quantity in cart.items.values()):
+        errors.append(f'user {user_id}: non-positive quantity {cart.items}')
+    return errors
+
+async def tap(store: CartStore, prices: dict, user_id: int, item_id: int, add: bool, expected: dict, errors: list):
+    await asyncio.sleep(random.random() / 1000)
+    if add:
+        cart = store.add(BOT_ID, user_id, STORE_ID, item_id, prices[item_id])
+        expected[item_id] = expected.get(item_id, 0) + 1
+    else:
+        cart = store.remove(BOT_ID, user_id, item_id)
+        if expected.get(item_id):
+            expected[item_id] -= 1
+    errors.extend(check(cart, user_id))
+    # THE HANDLER'S edit_message_text
+    await asyncio.sleep(random.random() / 1000)
+
+async def run(users: int, taps: int, items: int) -> list:
+    store = CartStore()
+    prices = {item_id: Decimal(random.randint(100, 500)) for item_id in range(1, items + 1)}
+    expected = {user_id: {} for user_id in range(users)}
+    errors = []
+
+    tasks = []
+    for i in range(taps):
+        if i == taps // 2:
+            prices = {item_id: price + 10 for item_id, price in prices.items()}
+        for user_id in range(users):
+            item_id = random.randint(1, items)
+            tasks.append(asyncio.create_task(
+                tap(store, prices, user_id, item_id, random.random() < 0.7, expected[user_id], errors)
+            ))
+        if i % 10 == 0:
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    for user_id in range(users):
+        cart = store.get(BOT_ID, user_id)
+        lines = {item_id: quantity for item_id, quantity in expected[user_id].items() if quantity}
+        if (cart.items if cart else {}) != lines:
+            errors.append(f'user {user_id}: cart {cart.items if cart else {}} != taps {lines}')
+        errors.extend(check(cart, user_id))
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--taps', type=int, default=500, help='concurrent taps per user')
+    parser.add_argument('--items', type=int, default=5)
+    args = parser.parse_args()
+
+    errors = asyncio.run(run(args.users, args.taps, args.items))
+    for error in errors[:20]:
+        print(error)
+    print(f'{args.users * args.taps} taps, {len(errors)} inconsistencies')
+    sys.exit(1 if errors else 0)